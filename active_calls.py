@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set
+from fastapi.encoders import jsonable_encoder
+from pg_listener import NotifyListener
+
+# 購読者ごとの未送信イベントの上限（溢れた購読者には全件を送り直す）
+ACTIVE_CALLS_QUEUE_SIZE = int(os.getenv("ACTIVE_CALLS_QUEUE_SIZE", "256"))
+# DBとの突き合わせ間隔（秒）。他ワーカーで開始・終了した通話を反映する
+ACTIVE_CALLS_RESYNC_SECONDS = float(os.getenv("ACTIVE_CALLS_RESYNC_SECONDS", "60"))
+
+# 通話中とみなすステータス
+ACTIVE_STATUSES = ("ringing", "answered", "in_progress")
+
+# 共有セッションレジストリ使用時に、通話中一覧の変化を他ワーカーへ配るチャネル
+ACTIVE_CALLS_CHANNEL = "active_calls"
+
+class ActiveCallRegistry:
+    def __init__(self, queue_size: int = ACTIVE_CALLS_QUEUE_SIZE):
+        """
+        通話中の一覧をメモリ上に保持し、変化をテナントの購読者に配信する
+
+        通話の作成・終了APIとWebSocketの接続・切断から更新するため、
+        一覧の取得やダッシュボードの監視でDBに問い合わせる必要がない。
+        共有セッションレジストリを使う（複数ワーカー）場合は、変化を Postgres の
+        NOTIFY で全ワーカーに配り、他のワーカーで起きた変化も即座に反映する。
+        値はJSONに変換した形で保持する（転送分・DBから読んだ分と比較できるように）。
+
+        Args:
+            queue_size: 購読者ごとの未送信イベントの上限
+        """
+        self.queue_size = queue_size
+        self._calls: Dict[str, dict] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # このプロセスで最後に更新した時刻（DBとの突き合わせで上書きしないため）
+        self._touched: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        # 他ワーカーとの共有（start時に共有レジストリなら有効）
+        self._worker_id: Optional[str] = None
+        self._listener: Optional[NotifyListener] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+        self._resync: Optional[asyncio.Task] = None
+        self.events_sent = 0
+        self.resyncs = 0
+        self.broadcasts = 0
+        self.received = 0
+
+    def calls(self, tenant_id) -> List[dict]:
+        """テナントの通話中一覧（開始時刻の新しい順）"""
+        tenant_id = str(tenant_id)
+        calls = [call for call in self._calls.values() if str(call.get("tenant_id")) == tenant_id]
+        return sorted(calls, key=lambda call: str(call.get("start_time") or ""), reverse=True)
+
+    def add(self, call: dict):
+        """通話を追加（作成時）"""
+        call = self._add(call)
+        self._broadcast({"op": "add", "call": call})
+
+    def update(self, call_id: str, **fields):
+        """通話の項目を更新（WebSocketの接続・切断時など）"""
+        fields = jsonable_encoder(fields)
+        self._update(str(call_id), fields)
+        # このワーカーの一覧になくても、持っているワーカーでは更新される
+        self._broadcast({"op": "update", "call_id": str(call_id), "fields": fields})
+
+    def remove(self, call_id: str):
+        """通話を削除（終了時）"""
+        self._remove(str(call_id))
+        self._broadcast({"op": "remove", "call_id": str(call_id)})
+
+    def _add(self, call: dict) -> dict:
+        call = jsonable_encoder({"is_connected": False, "has_ai_session": False, **call})
+        call_id = str(call["id"])
+        self._touched[call_id] = time.monotonic()
+        event = "call_updated" if call_id in self._calls else "call_started"
+        self._calls[call_id] = call
+        self._publish(call["tenant_id"], {"event": event, "call": call})
+        return call
+
+    def _update(self, call_id: str, fields: dict):
+        call = self._calls.get(call_id)
+        if call is None:
+            return
+        self._touched[call_id] = time.monotonic()
+        call.update(fields)
+        self._publish(call["tenant_id"], {"event": "call_updated", "call": call})
+
+    def _remove(self, call_id: str):
+        self._touched[call_id] = time.monotonic()
+        call = self._calls.pop(call_id, None)
+        if call is not None:
+            self._publish(call["tenant_id"], {"event": "call_ended", "call_id": call_id})
+
+    def _broadcast(self, message: dict):
+        """変化を他のワーカーへ送る（送信は順序を保つため1つのタスクで行う）"""
+        if self._outbox is None:
+            return
+        message["worker_id"] = self._worker_id
+        try:
+            self._outbox.put_nowait(json.dumps(message, ensure_ascii=False))
+        except asyncio.QueueFull:
+            # 送り切れない分は定期的な突き合わせで反映される
+            print("Warning: active call broadcast queue is full")
+
+    async def _send_loop(self, database):
+        while True:
+            payload = await self._outbox.get()
+            try:
+                async with database.pool.acquire() as conn:
+                    await conn.execute("SELECT pg_notify($1, $2)", ACTIVE_CALLS_CHANNEL, payload)
+                self.broadcasts += 1
+            except Exception as e:
+                print(f"Warning: failed to broadcast active call change: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("worker_id") == self._worker_id:
+            return
+        self.received += 1
+        if message["op"] == "add":
+            self._add(message["call"])
+        elif message["op"] == "update":
+            self._update(message["call_id"], message["fields"])
+        elif message["op"] == "remove":
+            self._remove(message["call_id"])
+
+    def subscribe(self, tenant_id) -> asyncio.Queue:
+        """テナントの変化の購読を開始"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(str(tenant_id), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, tenant_id, queue: asyncio.Queue):
+        """購読を終了"""
+        subscribers = self._subscribers.get(str(tenant_id))
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[str(tenant_id)]
+
+    def _publish(self, tenant_id, event: dict):
+        subscribers = self._subscribers.get(str(tenant_id))
+        if not subscribers:
+            return
+        event = jsonable_encoder(event)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # 受信が追いつかない購読者は差分を捨てて全件を送り直す
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(jsonable_encoder({"event": "snapshot", "calls": self.calls(tenant_id)}))
+            self.events_sent += 1
+
+    async def sync(self, database, sessions=None):
+        """
+        DB上の通話中一覧と突き合わせ、差分を反映・配信
+
+        sessions（セッションレジストリ）を渡した場合は、他のワーカーで
+        WebSocket接続中の通話も is_connected / has_ai_session に反映する。
+        突き合わせ中にこのプロセスで更新した通話は、こちらの内容を優先する。
+        """
+        started_at = time.monotonic()
+        rows = await database.get_active_calls()
+        current = {str(row["id"]): jsonable_encoder(row) for row in rows}
+        if sessions is not None:
+            connected = {session["call_id"] for session in await sessions.list()}
+            for call_id, row in current.items():
+                row["is_connected"] = row["has_ai_session"] = call_id in connected
+
+        for call_id, row in current.items():
+            if self._touched.get(call_id, 0) > started_at:
+                continue
+            call = self._calls.get(call_id)
+            if call is None:
+                self._add(row)
+            elif any(call.get(key) != value for key, value in row.items()):
+                self._update(call_id, row)
+
+        for call_id in [call_id for call_id in self._calls if call_id not in current]:
+            if self._touched.get(call_id, 0) <= started_at:
+                self._remove(call_id)
+
+        self._touched = {
+            call_id: touched for call_id, touched in self._touched.items() if touched > started_at
+        }
+        self.resyncs += 1
+
+    async def start(self, database, sessions=None):
+        """
+        DBから一覧を読み込み、定期的な突き合わせを開始
+
+        共有セッションレジストリを渡した場合は、他ワーカーとの変化の送受信も開始する。
+        """
+        if sessions is not None and sessions.shared and self._listener is None:
+            self._worker_id = sessions.worker_id
+            self._outbox = asyncio.Queue(maxsize=self.queue_size)
+            self._sender = asyncio.create_task(self._send_loop(database))
+            # 接続が切れていた間の変化はDBとの突き合わせで埋める
+            self._listener = NotifyListener(
+                database,
+                ACTIVE_CALLS_CHANNEL,
+                self._on_notify,
+                on_reconnect=lambda: self._schedule_sync(database, sessions)
+            )
+            await self._listener.start()
+        await self.sync(database, sessions)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(database, sessions))
+
+    async def stop(self):
+        """定期的な突き合わせと他ワーカーとの送受信を停止"""
+        if self._listener is not None:
+            await self._listener.stop()
+            self._listener = None
+        for task in (self._task, self._sender, self._resync):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._sender = self._resync = None
+        self._outbox = None
+
+    def _schedule_sync(self, database, sessions):
+        if self._resync is None or self._resync.done():
+            self._resync = asyncio.create_task(self._sync_quietly(database, sessions))
+
+    async def _sync_quietly(self, database, sessions):
+        try:
+            await self.sync(database, sessions)
+        except Exception as e:
+            print(f"Warning: failed to resync active calls: {e}")
+
+    async def _run(self, database, sessions):
+        while True:
+            await asyncio.sleep(ACTIVE_CALLS_RESYNC_SECONDS)
+            await self._sync_quietly(database, sessions)
+
+    def stats(self) -> dict:
+        return {
+            "calls": len(self._calls),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "events_sent": self.events_sent,
+            "resyncs": self.resyncs,
+            "broadcasts": self.broadcasts,
+            "received": self.received,
+            "listener": self._listener.stats() if self._listener else None
+        }
+
+# プロセス共有の通話中一覧
+active_calls = ActiveCallRegistry()
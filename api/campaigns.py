@@ -5,10 +5,10 @@ from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 from auth import get_current_tenant
-from database import Database
+from database import db
+from pagination import CountMode, decode_cursor, next_cursor, resolve_total, with_total
 
 router = APIRouter(prefix="/api/campaigns", tags=["campaigns"])
-db = Database()
 
 class TemplateCreate(BaseModel):
     name: str
@@ -74,12 +74,17 @@ async def list_campaigns(
     status: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    count: CountMode = Query("exact"),
     tenant = Depends(get_current_tenant)
 ):
-    """キャンペーン一覧取得"""
+    """キャンペーン一覧取得（countで総件数の取得方法を選択）"""
     try:
-        campaigns = await db.get_call_campaigns(tenant.id, status, limit, offset)
-        total = await db.get_call_campaigns_count(tenant.id, status)
+        campaigns = await db.get_call_campaigns(
+            tenant.id, status, limit, offset, with_total=with_total(count, None)
+        )
+        total = await resolve_total(
+            count, campaigns, lambda estimate: db.get_call_campaigns_count(tenant.id, status, estimate=estimate)
+        )
         
         return {
             "status": "success",
@@ -136,20 +141,30 @@ async def get_campaign_logs(
     campaign_id: str,
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
+    count: CountMode = Query("exact"),
     tenant = Depends(get_current_tenant)
 ):
-    """キャンペーンログ取得"""
+    """キャンペーンログ取得（cursor指定時はOFFSETを使わずに続きを取得、countで総件数の取得方法を選択）"""
     try:
-        logs = await db.get_campaign_logs(campaign_id, limit, offset)
-        total = await db.get_campaign_logs_count(campaign_id)
+        position = decode_cursor(cursor)
+        logs = await db.get_campaign_logs(
+            campaign_id, limit, offset, cursor=position, with_total=with_total(count, position)
+        )
+        total = await resolve_total(
+            count, logs, lambda estimate: db.get_campaign_logs_count(campaign_id, estimate=estimate)
+        )
         
         return {
             "status": "success",
             "logs": logs,
             "total": total,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor(logs, limit, ["attempted_at", "id"])
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
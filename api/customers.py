@@ -5,11 +5,11 @@ from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 from auth import get_current_tenant
-from database import Database
+from database import db
+from pagination import CountMode, decode_cursor, next_cursor, resolve_total, with_total
 from models import Customer, Tag
 
 router = APIRouter(prefix="/api/customers", tags=["customers"])
-db = Database()
 
 # ==================== Request/Response Models ====================
 
@@ -49,27 +49,37 @@ async def list_customers(
     tag_id: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
+    count: CountMode = Query("exact"),
     tenant = Depends(get_current_tenant)
 ):
-    """顧客一覧取得"""
+    """顧客一覧取得（cursor指定時はOFFSETを使わずに続きを取得、countで総件数の取得方法を選択）"""
     try:
+        position = decode_cursor(cursor)
         customers = await db.get_customers(
             tenant_id=tenant.id,
             search=search,
             tag_id=tag_id,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=position,
+            with_total=with_total(count, position)
         )
         
-        total = await db.get_customers_count(tenant.id, search, tag_id)
+        total = await resolve_total(
+            count, customers, lambda estimate: db.get_customers_count(tenant.id, search, tag_id, estimate=estimate)
+        )
         
         return {
             "status": "success",
             "customers": customers,
             "total": total,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor(customers, limit, ["created_at", "id"])
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
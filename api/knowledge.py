@@ -4,10 +4,11 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from typing import Optional, List
 from auth import get_current_tenant
-from database import Database
+from database import db
+from pagination import CountMode, decode_cursor, next_cursor, resolve_total, with_total
+from response_cache import invalidate_response_cache
 
 router = APIRouter(prefix="/api/knowledge", tags=["knowledge"])
-db = Database()
 
 # ==================== Request Models ====================
 
@@ -53,28 +54,39 @@ async def list_articles(
     tag_id: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
+    count: CountMode = Query("exact"),
     tenant = Depends(get_current_tenant)
 ):
-    """ナレッジ記事一覧取得"""
+    """ナレッジ記事一覧取得（cursor指定時はOFFSETを使わずに続きを取得、countで総件数の取得方法を選択）"""
     try:
+        position = decode_cursor(cursor)
         articles = await db.get_knowledge_articles(
             tenant_id=tenant.id,
             search=search,
             category_id=category_id,
             tag_id=tag_id,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=position,
+            with_total=with_total(count, position)
         )
         
-        total = await db.get_knowledge_articles_count(tenant.id, search, category_id, tag_id)
+        total = await resolve_total(
+            count, articles,
+            lambda estimate: db.get_knowledge_articles_count(tenant.id, search, category_id, tag_id, estimate=estimate)
+        )
         
         return {
             "status": "success",
             "articles": articles,
             "total": total,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor(articles, limit, ["relevance_score", "created_at", "id"])
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -93,6 +105,9 @@ async def create_article(
         if article.tag_ids:
             await db.add_article_tags(new_article['id'], article.tag_ids)
         
+        # ナレッジが変わったため、古い内容に基づく応答キャッシュを破棄
+        await invalidate_response_cache(tenant.id)
+        
         article_with_tags = await db.get_knowledge_article(new_article['id'], tenant.id)
         
         return {
@@ -118,6 +133,9 @@ async def update_article(
             if article.tag_ids:
                 await db.add_article_tags(article_id, article.tag_ids)
         
+        # ナレッジが変わったため、古い内容に基づく応答キャッシュを破棄
+        await invalidate_response_cache(tenant.id)
+        
         updated_article = await db.get_knowledge_article(article_id, tenant.id)
         
         return {
@@ -135,6 +153,9 @@ async def delete_article(
     """ナレッジ記事削除"""
     try:
         await db.delete_knowledge_article(article_id, tenant.id)
+        # ナレッジが変わったため、古い内容に基づく応答キャッシュを破棄
+        await invalidate_response_cache(tenant.id)
+        
         return {
             "status": "success",
             "message": "Article deleted successfully"
@@ -151,28 +172,39 @@ async def list_inquiries(
     priority: Optional[str] = Query(None),
     limit: int = Query(50, le=100),
     offset: int = Query(0),
+    cursor: Optional[str] = Query(None),
+    count: CountMode = Query("exact"),
     tenant = Depends(get_current_tenant)
 ):
-    """お問い合わせ一覧取得"""
+    """お問い合わせ一覧取得（cursor指定時はOFFSETを使わずに続きを取得、countで総件数の取得方法を選択）"""
     try:
+        position = decode_cursor(cursor)
         inquiries = await db.get_customer_inquiries(
             tenant_id=tenant.id,
             customer_id=customer_id,
             status=status,
             priority=priority,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=position,
+            with_total=with_total(count, position)
         )
         
-        total = await db.get_customer_inquiries_count(tenant.id, customer_id, status, priority)
+        total = await resolve_total(
+            count, inquiries,
+            lambda estimate: db.get_customer_inquiries_count(tenant.id, customer_id, status, priority, estimate=estimate)
+        )
         
         return {
             "status": "success",
             "inquiries": inquiries,
             "total": total,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor(inquiries, limit, ["created_at", "id"])
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
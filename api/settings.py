@@ -1,14 +1,13 @@
 """設定管理API - .env優先、なければDBから読み込み"""
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from pydantic import BaseModel
 from typing import Optional
 from auth import get_current_tenant
-from database import Database
+from database import db
 import os
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
-db = Database()
 
 class AsteriskSettings(BaseModel):
     ari_host: Optional[str] = None
@@ -107,6 +106,8 @@ async def get_all_settings(tenant = Depends(get_current_tenant)):
 @router.put("")
 async def update_settings(
     settings: AllSettings,
+    request: Request,
+    background_tasks: BackgroundTasks,
     tenant = Depends(get_current_tenant)
 ):
     """設定を更新（DBに保存）"""
@@ -173,6 +174,11 @@ async def update_settings(
         else:
             await db.create_tenant_settings(tenant.id, update_data)
         
+        # 定型文・音声設定の変更を合成音声キャッシュに反映
+        prewarm = getattr(request.app.state, "prewarm_tenant_phrases", None)
+        if prewarm and (settings.response or settings.azure_speech):
+            background_tasks.add_task(prewarm, tenant.id)
+        
         return {
             "status": "success",
             "message": "Settings updated successfully"
@@ -4,10 +4,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from auth import get_current_tenant
-from database import Database
+from database import db
 
 router = APIRouter(prefix="/api/tags", tags=["tags"])
-db = Database()
 
 class TagCreate(BaseModel):
     name: str
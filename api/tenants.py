@@ -3,11 +3,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from auth import get_current_tenant
-from database import Database
+from auth import get_current_tenant, invalidate_tenant
+from database import db
 
 router = APIRouter(prefix="/api/tenants", tags=["tenants"])
-db = Database()
 
 class TenantCreate(BaseModel):
     name: str
@@ -77,6 +76,9 @@ async def update_tenant(
         if not updated_tenant:
             raise HTTPException(status_code=404, detail="Tenant not found")
         
+        # 認証用のテナントキャッシュに変更を反映
+        await invalidate_tenant(tenant_id)
+        
         return {
             "status": "success",
             "tenant": updated_tenant
@@ -91,6 +93,8 @@ async def delete_tenant(tenant_id: str):
     """テナント削除（管理者のみ）"""
     try:
         await db.delete_tenant(tenant_id)
+        await invalidate_tenant(tenant_id)
+        
         return {
             "status": "success",
             "message": "Tenant deleted successfully"
@@ -0,0 +1,138 @@
+import os
+from typing import Optional
+
+# 1発話の最大長（超えた場合は強制的に区切って認識に回す）
+UTTERANCE_MAX_MS = int(os.getenv("UTTERANCE_MAX_MS", "15000"))
+# 発話開始直前から保持しておく音声の長さ（VADの立ち上がり遅れを補う）
+UTTERANCE_PRE_ROLL_MS = int(os.getenv("UTTERANCE_PRE_ROLL_MS", "300"))
+
+class UtteranceBuffer:
+    def __init__(
+        self,
+        sample_rate: int = 8000,
+        max_ms: int = UTTERANCE_MAX_MS,
+        pre_roll_ms: int = UTTERANCE_PRE_ROLL_MS,
+        store: bool = True
+    ):
+        """
+        通話単位の発話音声バッファを初期化
+
+        通話開始時に最大長ぶんのbytearrayを確保し、フレームごとの
+        リスト追加・結合を行わずに直接書き込む。
+        発話していない間は直近pre_roll_ms分をリングバッファに保持し、
+        発話開始時に先頭へ書き戻す。
+
+        Args:
+            sample_rate: サンプリングレート（16-bit mono PCM）
+            max_ms: 1発話の最大長
+            pre_roll_ms: 発話開始直前から保持する長さ
+            store: Falseの場合は音声を保持せず長さだけを数える（連続認識用）
+        """
+        bytes_per_ms = sample_rate * 2 // 1000
+        self.store = store
+        self.max_bytes = max_ms * bytes_per_ms
+        self.pre_roll_bytes = pre_roll_ms * bytes_per_ms if store else 0
+        self._bytes_per_ms = bytes_per_ms
+
+        # 発話終了で受け渡したビューを次の発話で上書きしないよう2面を交互に使う
+        size = self.max_bytes + self.pre_roll_bytes if store else 0
+        self._buffers = [memoryview(bytearray(size)), memoryview(bytearray(size))]
+        self._current = 0
+        self._length = 0
+
+        self._ring = memoryview(bytearray(self.pre_roll_bytes))
+        self._ring_pos = 0
+        self._ring_filled = 0
+
+        self.active = False
+
+    @property
+    def duration_ms(self) -> int:
+        """現在の発話の長さ（ミリ秒）"""
+        return self._length // self._bytes_per_ms
+
+    @property
+    def is_full(self) -> bool:
+        """最大長に達したかどうか"""
+        return self._length >= self.max_bytes
+
+    def feed(self, data: bytes):
+        """発話していない間のフレームをプリロールとして保持"""
+        if not self.pre_roll_bytes:
+            return
+
+        data = memoryview(data)
+        if len(data) >= self.pre_roll_bytes:
+            self._ring[:] = data[-self.pre_roll_bytes:]
+            self._ring_pos = 0
+            self._ring_filled = self.pre_roll_bytes
+            return
+
+        end = self._ring_pos + len(data)
+        if end <= self.pre_roll_bytes:
+            self._ring[self._ring_pos:end] = data
+        else:
+            split = self.pre_roll_bytes - self._ring_pos
+            self._ring[self._ring_pos:] = data[:split]
+            self._ring[:end - self.pre_roll_bytes] = data[split:]
+        self._ring_pos = end % self.pre_roll_bytes
+        self._ring_filled = min(self._ring_filled + len(data), self.pre_roll_bytes)
+
+    def start(self, pre_roll: bool = True):
+        """
+        発話の記録を開始
+
+        Args:
+            pre_roll: 保持しているプリロールを発話の先頭に含めるかどうか
+        """
+        self.active = True
+        self._length = 0
+        if pre_roll and self._ring_filled:
+            buffer = self._buffers[self._current]
+            # リングの古い側から順に書き戻す
+            start = (self._ring_pos - self._ring_filled) % self.pre_roll_bytes
+            head = min(self._ring_filled, self.pre_roll_bytes - start)
+            buffer[:head] = self._ring[start:start + head]
+            buffer[head:self._ring_filled] = self._ring[:self._ring_filled - head]
+            self._length = self._ring_filled
+        self._ring_pos = 0
+        self._ring_filled = 0
+
+    def append(self, data: bytes) -> bool:
+        """
+        発話中のフレームを追記
+
+        Returns:
+            bool: 最大長に達した場合True（呼び出し側で強制的に区切る）
+        """
+        if not self.active:
+            self.start()
+
+        if self.store:
+            room = self.max_bytes + self.pre_roll_bytes - self._length
+            size = min(len(data), room)
+            self._buffers[self._current][self._length:self._length + size] = memoryview(data)[:size]
+            self._length += size
+        else:
+            self._length += len(data)
+        return self.is_full
+
+    def take(self) -> Optional[memoryview]:
+        """
+        記録した発話をコピーせずに取り出して記録を終了
+
+        返すビューはバッファの一部を直接指す。次の次の発話で
+        上書きされるため、それまでに認識へ渡し終えること。
+
+        Returns:
+            Optional[memoryview]: 発話音声（store=Falseの場合はNone）
+        """
+        self.active = False
+        length = self._length
+        self._length = 0
+        if not self.store:
+            return None
+
+        audio = self._buffers[self._current][:length]
+        self._current = 1 - self._current
+        return audio
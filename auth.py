@@ -1,10 +1,133 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
-from database import Database
+from collections import OrderedDict
+import asyncpg
+import os
+import time
+from database import Database, db
+from pg_listener import NotifyListener
 
 security = HTTPBearer()
-db = Database()
+
+# テナント情報キャッシュの有効期限（秒）と件数上限
+TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", "60"))
+TENANT_CACHE_NEGATIVE_TTL = float(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "10"))
+TENANT_CACHE_MAX_SIZE = int(os.getenv("TENANT_CACHE_MAX_SIZE", "1000"))
+# Postgres LISTEN/NOTIFYで他ワーカーのキャッシュも無効化するかどうか
+TENANT_CACHE_NOTIFY = os.getenv("TENANT_CACHE_NOTIFY", "false").lower() == "true"
+TENANT_CACHE_CHANNEL = "tenant_changed"
+
+class TenantCache:
+    def __init__(
+        self,
+        ttl: float = TENANT_CACHE_TTL,
+        negative_ttl: float = TENANT_CACHE_NEGATIVE_TTL,
+        max_size: int = TENANT_CACHE_MAX_SIZE
+    ):
+        """
+        認証で参照するテナント情報のプロセス内キャッシュを初期化
+
+        存在しないテナントID（不正なトークン）も短時間キャッシュし、
+        同じトークンでの問い合わせがDBに届かないようにする。
+
+        Args:
+            ttl: テナント情報の有効期限（秒）
+            negative_ttl: 存在しないテナントIDの有効期限（秒）
+            max_size: 件数上限（超えたら古い順に削除）
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tenant_id: str):
+        """
+        キャッシュ済みのテナントを取得
+
+        Returns:
+            (found, tenant): foundがFalseの場合はキャッシュなし。
+            tenantがNoneの場合は存在しないテナントとしてキャッシュ済み
+        """
+        entry = self._entries.get(tenant_id)
+        if entry is None or entry[1] <= time.monotonic():
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(tenant_id)
+        self.hits += 1
+        return True, entry[0]
+
+    def set(self, tenant_id: str, tenant):
+        """テナント（存在しない場合はNone）をキャッシュ"""
+        ttl = self.ttl if tenant else self.negative_ttl
+        self._entries[tenant_id] = (tenant, time.monotonic() + ttl)
+        self._entries.move_to_end(tenant_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        """テナントのキャッシュを破棄（tenant_id省略時は全件）"""
+        if tenant_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(tenant_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+tenant_cache = TenantCache()
+
+async def invalidate_tenant(tenant_id: str):
+    """
+    テナントの更新・削除をキャッシュに反映
+
+    TENANT_CACHE_NOTIFY=trueの場合は他ワーカーにもNOTIFYで通知する。
+    """
+    tenant_cache.invalidate(tenant_id)
+    if TENANT_CACHE_NOTIFY and db.pool:
+        try:
+            async with db.pool.acquire() as conn:
+                await conn.execute("SELECT pg_notify($1, $2)", TENANT_CACHE_CHANNEL, tenant_id)
+        except Exception as e:
+            print(f"Warning: failed to notify tenant invalidation: {e}")
+
+def _on_tenant_notify(connection, pid, channel, payload):
+    tenant_cache.invalidate(payload or None)
+
+async def start_tenant_cache_listener(database: Database) -> Optional[NotifyListener]:
+    """
+    他ワーカーからのテナント無効化通知の受信を開始（TENANT_CACHE_NOTIFY=true時）
+
+    専用接続でLISTENし、接続が切れていた間の通知を取りこぼした可能性があるため
+    再接続時はキャッシュを全件破棄する。
+
+    Returns:
+        Optional[NotifyListener]: 受信中のリスナー（停止時にclose_tenant_cache_listenerへ渡す）
+    """
+    if not TENANT_CACHE_NOTIFY:
+        return None
+
+    listener = NotifyListener(
+        database,
+        TENANT_CACHE_CHANNEL,
+        _on_tenant_notify,
+        on_reconnect=tenant_cache.invalidate
+    )
+    await listener.start()
+    return listener
+
+async def close_tenant_cache_listener(listener: Optional[NotifyListener]):
+    """テナント無効化通知の受信を停止"""
+    if listener is not None:
+        await listener.stop()
 
 async def get_current_tenant(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -15,7 +138,14 @@ async def get_current_tenant(
     """
     try:
         tenant_id = credentials.credentials
-        tenant = await db.get_tenant(tenant_id)
+        found, tenant = tenant_cache.get(tenant_id)
+        if not found:
+            try:
+                tenant = await db.get_tenant(tenant_id)
+            except asyncpg.DataError:
+                # UUIDとして不正なトークン
+                tenant = None
+            tenant_cache.set(tenant_id, tenant)
         
         if not tenant:
             raise HTTPException(
@@ -0,0 +1,135 @@
+import asyncio
+import json
+from typing import Awaitable, Callable, Optional, Set
+from database import Database
+from pg_listener import NotifyListener
+from session_registry import SessionRegistry
+
+# 通話の制御イベントを保持ワーカーへ転送するチャネル
+CALL_CONTROL_CHANNEL = "call_control"
+
+# 制御イベントの処理（call_id, イベント）
+CallEventHandler = Callable[[str, dict], Awaitable[None]]
+
+class CallRouter:
+    def __init__(
+        self,
+        database: Database,
+        sessions: SessionRegistry,
+        handler: CallEventHandler,
+        is_local: Callable[[str], bool]
+    ):
+        """
+        通話の制御イベント（終了・DTMFなど）を通話を保持するワーカーへ届ける
+
+        WebSocketを受けたワーカーがセッションレジストリに所有者として記録され、
+        別のワーカーに届いた制御イベントは Postgres の NOTIFY で所有者へ転送する。
+        共有レジストリを使わない場合（ワーカー1つ）は転送せずにその場で処理する。
+
+        Args:
+            database: NOTIFY/LISTENに使うデータベース
+            sessions: 通話の所有者を記録するセッションレジストリ
+            handler: このワーカーが保持する通話へのイベントを処理する関数
+            is_local: 通話をこのワーカーが保持しているかどうか
+        """
+        self.database = database
+        self.sessions = sessions
+        self.handler = handler
+        self.is_local = is_local
+        self._listener: Optional[NotifyListener] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.handled = 0
+        self.forwarded = 0
+        self.received = 0
+        self.unowned = 0
+
+    async def start(self):
+        """他ワーカーからの転送の受信を開始（共有レジストリ使用時）"""
+        if not self.sessions.shared or self._listener is not None:
+            return
+        # 専用接続でLISTENし、接続が切れた場合は再接続する
+        self._listener = NotifyListener(self.database, CALL_CONTROL_CHANNEL, self._on_notify)
+        await self._listener.start()
+
+    async def stop(self):
+        """受信を停止し、処理中のイベントを待つ"""
+        if self._listener is not None:
+            await self._listener.stop()
+            self._listener = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def dispatch(self, call_id: str, event: dict) -> str:
+        """
+        制御イベントを通話の所有者で処理
+
+        Returns:
+            str: local（このワーカーで処理）/ forwarded（所有者へ転送）/ unowned（接続中のワーカーなし）
+        """
+        if self.is_local(call_id):
+            await self._handle(call_id, event)
+            return "local"
+
+        owner = await self.sessions.get(call_id)
+        if owner and not self.sessions.is_local(owner):
+            await self.send(owner["worker_id"], call_id, event)
+            return "forwarded"
+
+        self.unowned += 1
+        return "unowned"
+
+    async def claim(self, call_id: str, tenant_id: str):
+        """
+        通話の所有者としてこのワーカーを記録
+
+        再接続が別のワーカーに届いた場合は、前の所有者に古いセッションの解放を依頼する。
+        """
+        previous = await self.sessions.get(call_id)
+        await self.sessions.register(call_id, tenant_id)
+        if previous and not self.sessions.is_local(previous):
+            try:
+                await self.send(previous["worker_id"], call_id, {"type": "release"})
+            except Exception as e:
+                print(f"Warning: failed to release call on previous worker: {e}")
+
+    async def send(self, worker_id: str, call_id: str, event: dict):
+        """指定したワーカーへイベントを送る"""
+        payload = json.dumps({"worker_id": worker_id, "call_id": str(call_id), "event": event})
+        async with self.database.pool.acquire() as conn:
+            await conn.execute("SELECT pg_notify($1, $2)", CALL_CONTROL_CHANNEL, payload)
+        self.forwarded += 1
+
+    async def _handle(self, call_id: str, event: dict):
+        self.handled += 1
+        await self.handler(call_id, event)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("worker_id") != self.sessions.worker_id:
+            return
+        self.received += 1
+        task = asyncio.create_task(self._handle_forwarded(message["call_id"], message["event"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_forwarded(self, call_id: str, event: dict):
+        try:
+            if self.is_local(call_id):
+                await self._handle(call_id, event)
+            else:
+                self.unowned += 1
+        except Exception as e:
+            print(f"Error handling forwarded call event: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "listening": self._listener is not None and self._listener.listening,
+            "listener": self._listener.stats() if self._listener else None,
+            "handled": self.handled,
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "unowned": self.unowned
+        }
@@ -1,15 +1,63 @@
 import asyncpg
-from typing import Optional, List
+from typing import Optional, List, Set
+import json
 import os
-from datetime import datetime
+import re
+from datetime import datetime, timedelta, timezone
 from models import FaxDocument
 
+# 接続プール設定（全ワーカーの max_size 合計が Postgres の max_connections に収まるようにする）
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+
+# 件数クエリの先頭（推定件数の取得時は SELECT 1 に置き換えてEXPLAINする）
+_COUNT_SELECT = re.compile(r"^\s*SELECT\s+COUNT\([^)]*\)", re.IGNORECASE)
+
+# 集計の対象外とする（通話中の）ステータス
+_ACTIVE_CALL_STATUSES = "('ringing', 'answered', 'in_progress')"
+
+def _floor_hour(value: datetime) -> datetime:
+    """時刻をUTCの1時間単位に切り捨て（タイムゾーンなしはUTCとみなす）"""
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _ceil_hour(value: datetime) -> datetime:
+    """時刻をUTCの1時間単位に切り上げ"""
+    floor = _floor_hour(value)
+    return floor if floor == value else floor + timedelta(hours=1)
+
+def _total_column(with_total: bool) -> str:
+    """一覧クエリに総件数を同時に取得する列を追加（COUNT(*) OVER()で1回のクエリにまとめる）"""
+    return ", COUNT(*) OVER() AS total_count" if with_total else ""
+
 class Database:
     def __init__(self):
         self.pool = None
+        # プール外の専用接続（LISTEN用。プールの飽和度には含めない）
+        self._dedicated: Set[asyncpg.Connection] = set()
         
+    @staticmethod
+    def _connect_params() -> dict:
+        """接続プール・専用接続に共通の接続設定"""
+        return {
+            "user": os.getenv("POSTGRES_USER", "voiceai"),
+            "password": os.getenv("POSTGRES_PASSWORD", "Firstlaunch4321"),
+            "database": os.getenv("POSTGRES_DB", "voiceai"),
+            "host": os.getenv("POSTGRES_HOST", "localhost"),
+            "command_timeout": DB_COMMAND_TIMEOUT,
+            "server_settings": {
+                'client_encoding': 'UTF8',
+                'timezone': 'UTC'
+            }
+        }
+
     async def connect(self):
         """データベース接続プールを初期化"""
+        if self.pool:
+            return
         try:
             # 接続前にデバッグ情報を出力
             print("Connecting to database with following parameters:")
@@ -18,17 +66,10 @@ class Database:
             print(f"User: {os.getenv('POSTGRES_USER', 'voiceai')}")
             
             self.pool = await asyncpg.create_pool(
-                user=os.getenv("POSTGRES_USER", "voiceai"),
-                password=os.getenv("POSTGRES_PASSWORD", "Firstlaunch4321"),
-                database=os.getenv("POSTGRES_DB", "voiceai"),
-                host=os.getenv("POSTGRES_HOST", "localhost"),
-                command_timeout=60,
-                min_size=1,
-                max_size=10,
-                server_settings={
-                    'client_encoding': 'UTF8',
-                    'timezone': 'UTC'
-                }
+                **self._connect_params(),
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE
             )
             print("Database connection pool created successfully")
             
@@ -40,7 +81,57 @@ class Database:
         """データベース接続を終了"""
         if self.pool:
             await self.pool.close()
+            self.pool = None
             print("Database connection pool closed")
+    
+    async def create_connection(self) -> asyncpg.Connection:
+        """
+        プール外の専用接続を作成（LISTENのように接続を占有し続ける用途）
+
+        呼び出し側が close() する。
+        """
+        conn = await asyncpg.connect(**self._connect_params())
+        self._dedicated.add(conn)
+        return conn
+
+    def pool_stats(self) -> dict:
+        """
+        接続プールの使用状況（使用中の接続数が max_size に近いほど飽和）
+
+        LISTENで占有し続ける専用接続はプールの枠を使わないため、dedicated として別に数える。
+        """
+        self._dedicated = {conn for conn in self._dedicated if not conn.is_closed()}
+        if not self.pool:
+            return {"connected": False, "dedicated": len(self._dedicated)}
+        size = self.pool.get_size()
+        in_use = size - self.pool.get_idle_size()
+        max_size = self.pool.get_max_size()
+        return {
+            "connected": True,
+            "size": size,
+            "in_use": in_use,
+            "idle": size - in_use,
+            "min_size": self.pool.get_min_size(),
+            "max_size": max_size,
+            "saturation": in_use / max_size if max_size else 0.0,
+            "dedicated": len(self._dedicated)
+        }
+            
+    async def _count(self, conn, query: str, params: list, estimate: bool = False) -> int:
+        """
+        件数クエリを実行
+        
+        estimate=Trueの場合はCOUNTを実行せず、EXPLAINによるプランナの推定行数を返す。
+        統計情報（ANALYZE）に基づく概算のため正確ではないが、件数に比例した走査をしない。
+        """
+        if not estimate:
+            return await conn.fetchval(query, *params)
+        plan = await conn.fetchval(
+            f"EXPLAIN (FORMAT JSON) {_COUNT_SELECT.sub('SELECT 1', query, count=1)}", *params
+        )
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
             
     async def get_call_session(self, call_id: str):
         """通話セッション情報を取得"""
@@ -64,6 +155,22 @@ class Database:
                 call_id, content, type, datetime.utcnow()
             )
             
+    async def save_messages(self, rows: List[tuple]):
+        """
+        メッセージをまとめて保存
+        
+        Args:
+            rows: (call_id, content, type, created_at) のリスト
+        """
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO messages (call_id, content, type, created_at)
+                VALUES ($1, $2, $3, $4)
+                """,
+                rows
+            )
+            
     async def get_messages(self, call_id: str) -> List[dict]:
         """通話セッションのメッセージ履歴を取得"""
         async with self.pool.acquire() as conn:
@@ -133,6 +240,91 @@ class Database:
                 fax_id, status, error_message
             )
     
+    async def enqueue_fax_document(
+        self,
+        tenant_id: str,
+        sender_number: str,
+        receiver_number: str,
+        tiff_path: str,
+        pages: Optional[int] = None
+    ) -> FaxDocument:
+        """受信FAXを処理待ち（queued）として登録"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO fax_documents (
+                    tenant_id, direction, sender_number, receiver_number,
+                    status, tiff_path, pages, next_attempt_at
+                )
+                VALUES ($1, 'inbound', $2, $3, 'queued', $4, $5, now())
+                RETURNING *
+                """,
+                tenant_id, sender_number, receiver_number, tiff_path, pages
+            )
+            return FaxDocument(**dict(row))
+    
+    async def claim_fax_job(self, lock_timeout: float) -> Optional[dict]:
+        """
+        処理待ちのFAXを1件取得して処理中（converting）にする
+        
+        複数ワーカーが同時に取得しても同じ行は1つのワーカーにしか渡らない。
+        lock_timeout秒を過ぎても処理中のままの行（停止したワーカーの分）も取得し直す。
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE fax_documents
+                SET status = 'converting',
+                    attempts = attempts + 1,
+                    locked_at = now(),
+                    processed_at = now()
+                WHERE id = (
+                    SELECT id FROM fax_documents
+                    WHERE (status = 'queued' AND next_attempt_at <= now())
+                       OR (status IN ('converting', 'ocr') AND locked_at < now() - make_interval(secs => $1))
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                lock_timeout
+            )
+            return dict(row) if row else None
+    
+    async def retry_fax_job(self, fax_id: str, error_message: str, delay: float):
+        """処理に失敗したFAXをdelay秒後に再処理する"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE fax_documents
+                SET status = 'queued',
+                    error_message = $2,
+                    next_attempt_at = now() + make_interval(secs => $3),
+                    locked_at = NULL,
+                    processed_at = now()
+                WHERE id = $1
+                """,
+                fax_id, error_message, delay
+            )
+    
+    async def complete_fax_job(self, fax_id: str, pdf_path: str, ocr_text: str):
+        """FAXの処理結果を保存して完了（completed）にする"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE fax_documents
+                SET status = 'completed',
+                    pdf_path = $2,
+                    ocr_text = $3,
+                    error_message = NULL,
+                    locked_at = NULL,
+                    processed_at = now()
+                WHERE id = $1
+                """,
+                fax_id, pdf_path, ocr_text
+            )
+    
     async def create_call_session(
         self,
         call_id: str,
@@ -183,34 +375,69 @@ class Database:
                     call_id, status
                 )
     
+    async def update_call_conversation_id(self, call_id: str, conversation_id: Optional[str]):
+        """通話セッションのDify会話IDを更新"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE call_sessions
+                SET dify_conversation_id = $2
+                WHERE id = $1
+                """,
+                call_id, conversation_id
+            )
+    
     async def get_call_sessions(
         self,
         tenant_id: str,
         limit: int = 50,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[tuple] = None,
+        with_total: bool = False
     ) -> List[dict]:
-        """通話セッション一覧を取得"""
+        """
+        通話セッション一覧を取得
+        
+        cursor（直前のページ最後の (start_time, id)）を指定した場合は
+        OFFSETを使わずにその続きから取得する。
+        with_total=Trueの場合は各行に絞り込み後の総件数（total_count）を付ける。
+        """
+        total_column = _total_column(with_total)
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT * FROM call_sessions 
-                WHERE tenant_id = $1 
-                ORDER BY start_time DESC 
-                LIMIT $2 OFFSET $3
-                """,
-                tenant_id, limit, offset
-            )
+            if cursor:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT *{total_column} FROM call_sessions 
+                    WHERE tenant_id = $1 
+                      AND (start_time, id) < ($2, $3)
+                    ORDER BY start_time DESC, id DESC 
+                    LIMIT $4
+                    """,
+                    tenant_id, *cursor, limit
+                )
+            else:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT *{total_column} FROM call_sessions 
+                    WHERE tenant_id = $1 
+                    ORDER BY start_time DESC, id DESC 
+                    LIMIT $2 OFFSET $3
+                    """,
+                    tenant_id, limit, offset
+                )
             return [dict(row) for row in rows]
     
-    async def get_call_sessions_count(self, tenant_id: str) -> int:
-        """通話セッション数を取得"""
+    async def get_call_sessions_count(self, tenant_id: str, estimate: bool = False) -> int:
+        """通話セッション数を取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(
+            return await self._count(
+                conn,
                 """
                 SELECT COUNT(*) FROM call_sessions 
                 WHERE tenant_id = $1
                 """,
-                tenant_id
+                [tenant_id],
+                estimate
             )
     
     async def save_dtmf(
@@ -229,6 +456,22 @@ class Database:
                 call_id, digit, timestamp or datetime.utcnow()
             )
     
+    async def save_dtmf_events(self, rows: List[tuple]):
+        """
+        DTMF入力をまとめて保存
+        
+        Args:
+            rows: (call_id, digit, created_at) のリスト
+        """
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO dtmf_events (call_id, digit, created_at)
+                VALUES ($1, $2, $3)
+                """,
+                rows
+            )
+    
     async def get_tenant_greeting(self, tenant_id: str) -> Optional[dict]:
         """テナントの挨拶メッセージ設定を取得"""
         async with self.pool.acquire() as conn:
@@ -284,35 +527,196 @@ class Database:
             """
             await conn.execute(query, tenant_id, *settings.values())
     
+    def _call_stats_parts(
+        self,
+        tenant_id: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> tuple:
+        """
+        統計の対象行を返すSQLを組み立てる
+        
+        期間内の集計済みの時間帯は call_stats_hourly の集計行を使い、
+        期間の両端の端数と、通話中・集計待ちの通話だけを call_sessions から読む。
+        
+        Returns:
+            (SQL, パラメータ)
+        """
+        params = [tenant_id]
+        rollup_filters = ""
+        raw_filters = ""
+        
+        if start_date:
+            params.append(start_date)
+            raw_filters += f" AND start_time >= ${len(params)}"
+        if end_date:
+            params.append(end_date)
+            raw_filters += f" AND start_time <= ${len(params)}"
+        
+        lower = _ceil_hour(start_date) if start_date else None
+        upper = _floor_hour(end_date) if end_date else None
+        if lower and upper and lower >= upper:
+            # 1時間の区切りをまたがない期間は生データだけで数える
+            rollup_filters += " AND FALSE"
+        else:
+            raw_sources = ["NOT stats_rolled_up"]
+            if lower:
+                params.append(lower)
+                rollup_filters += f" AND bucket >= ${len(params)}"
+                raw_sources.append(f"start_time < ${len(params)}")
+            if upper:
+                params.append(upper)
+                rollup_filters += f" AND bucket < ${len(params)}"
+                raw_sources.append(f"start_time >= ${len(params)}")
+            raw_filters += f" AND ({' OR '.join(raw_sources)})"
+        
+        query = f"""
+            SELECT bucket AS at, total_calls, completed_calls, failed_calls,
+                duration_count, duration_sum, duration_min, duration_max
+            FROM call_stats_hourly
+            WHERE tenant_id = $1{rollup_filters}
+            UNION ALL
+            SELECT start_time, 1,
+                (status = 'completed')::int,
+                (status = 'failed')::int,
+                (end_time IS NOT NULL)::int,
+                COALESCE(EXTRACT(EPOCH FROM (end_time - start_time)), 0)::float8,
+                EXTRACT(EPOCH FROM (end_time - start_time))::float8,
+                EXTRACT(EPOCH FROM (end_time - start_time))::float8
+            FROM call_sessions
+            WHERE tenant_id = $1{raw_filters}
+        """
+        return query, params
+    
     async def get_call_statistics(
         self,
         tenant_id: str,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None
     ) -> dict:
-        """通話統計を取得"""
+        """通話統計を取得（開始日・終了日はどちらか一方だけでも指定可）"""
+        parts, params = self._call_stats_parts(tenant_id, start_date, end_date)
         async with self.pool.acquire() as conn:
-            query = """
+            row = await conn.fetchrow(
+                f"""
+                WITH parts AS ({parts})
                 SELECT 
-                    COUNT(*) as total_calls,
-                    COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed_calls,
-                    COUNT(CASE WHEN status = 'failed' THEN 1 END) as failed_calls,
-                    AVG(EXTRACT(EPOCH FROM (end_time - start_time))) as avg_duration
-                FROM call_sessions
-                WHERE tenant_id = $1
-            """
-            params = [tenant_id]
-            
-            if start_date and end_date:
-                query += " AND start_time BETWEEN $2 AND $3"
-                params.extend([start_date, end_date])
-            
-            row = await conn.fetchrow(query, *params)
+                    COALESCE(SUM(total_calls), 0) as total_calls,
+                    COALESCE(SUM(completed_calls), 0) as completed_calls,
+                    COALESCE(SUM(failed_calls), 0) as failed_calls,
+                    SUM(duration_sum) / NULLIF(SUM(duration_count), 0) as avg_duration,
+                    MIN(duration_min) as min_duration,
+                    MAX(duration_max) as max_duration
+                FROM parts
+                """,
+                *params
+            )
             return dict(row) if row else {}
     
-    async def get_active_calls(self, tenant_id: str) -> List[dict]:
-        """アクティブな通話一覧を取得"""
+    async def get_call_statistics_series(
+        self,
+        tenant_id: str,
+        interval: str,
+        time_zone: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[dict]:
+        """
+        通話統計を時間帯ごとに取得
+        
+        Args:
+            interval: 集計単位（hour / day）
+            time_zone: 区切りのタイムゾーン（例: Asia/Tokyo）
+        """
+        parts, params = self._call_stats_parts(tenant_id, start_date, end_date)
+        params.extend([interval, time_zone])
+        bucket = f"date_trunc(${len(params) - 1}, at, ${len(params)})"
         async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                WITH parts AS ({parts})
+                SELECT 
+                    {bucket} as bucket,
+                    SUM(total_calls) as total_calls,
+                    SUM(completed_calls) as completed_calls,
+                    SUM(failed_calls) as failed_calls,
+                    SUM(duration_sum) / NULLIF(SUM(duration_count), 0) as avg_duration,
+                    MIN(duration_min) as min_duration,
+                    MAX(duration_max) as max_duration
+                FROM parts
+                WHERE at IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                *params
+            )
+            return [dict(row) for row in rows]
+    
+    async def rollup_call_stats(self, call_id: Optional[str] = None):
+        """
+        終了した通話を時間別集計（call_stats_hourly）に足し込む
+        
+        集計済みの印（stats_rolled_up）を付けた行だけを足し込むため、
+        同じ通話を何度渡しても二重には数えない。
+        
+        Args:
+            call_id: 対象の通話（省略時は集計待ちの終了済み通話すべて）
+        """
+        params = []
+        target = ""
+        if call_id:
+            params.append(call_id)
+            target = " AND id = $1"
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                WITH rolled AS (
+                    UPDATE call_sessions SET stats_rolled_up = TRUE
+                    WHERE NOT stats_rolled_up
+                      AND start_time IS NOT NULL
+                      AND status NOT IN {_ACTIVE_CALL_STATUSES}{target}
+                    RETURNING tenant_id, start_time, end_time, status
+                )
+                INSERT INTO call_stats_hourly (
+                    tenant_id, bucket, total_calls, completed_calls, failed_calls,
+                    duration_count, duration_sum, duration_min, duration_max
+                )
+                SELECT
+                    tenant_id,
+                    date_trunc('hour', start_time, 'UTC'),
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE status = 'completed'),
+                    COUNT(*) FILTER (WHERE status = 'failed'),
+                    COUNT(end_time),
+                    COALESCE(SUM(EXTRACT(EPOCH FROM (end_time - start_time))), 0),
+                    MIN(EXTRACT(EPOCH FROM (end_time - start_time))),
+                    MAX(EXTRACT(EPOCH FROM (end_time - start_time)))
+                FROM rolled
+                GROUP BY tenant_id, date_trunc('hour', start_time, 'UTC')
+                ON CONFLICT (tenant_id, bucket) DO UPDATE SET
+                    total_calls = call_stats_hourly.total_calls + EXCLUDED.total_calls,
+                    completed_calls = call_stats_hourly.completed_calls + EXCLUDED.completed_calls,
+                    failed_calls = call_stats_hourly.failed_calls + EXCLUDED.failed_calls,
+                    duration_count = call_stats_hourly.duration_count + EXCLUDED.duration_count,
+                    duration_sum = call_stats_hourly.duration_sum + EXCLUDED.duration_sum,
+                    duration_min = LEAST(call_stats_hourly.duration_min, EXCLUDED.duration_min),
+                    duration_max = GREATEST(call_stats_hourly.duration_max, EXCLUDED.duration_max)
+                """,
+                *params
+            )
+    
+    async def get_active_calls(self, tenant_id: Optional[str] = None) -> List[dict]:
+        """アクティブな通話一覧を取得（tenant_id省略時は全テナント）"""
+        async with self.pool.acquire() as conn:
+            if tenant_id is None:
+                rows = await conn.fetch(
+                    """
+                    SELECT * FROM call_sessions 
+                    WHERE status IN ('ringing', 'answered', 'in_progress')
+                    ORDER BY start_time DESC
+                    """
+                )
+                return [dict(row) for row in rows]
             rows = await conn.fetch(
                 """
                 SELECT * FROM call_sessions 
@@ -332,12 +736,14 @@ class Database:
         search: Optional[str] = None,
         tag_id: Optional[str] = None,
         limit: int = 50,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[tuple] = None,
+        with_total: bool = False
     ) -> List[dict]:
-        """顧客一覧取得"""
+        """顧客一覧取得（cursorは直前のページ最後の (created_at, id)）"""
         async with self.pool.acquire() as conn:
-            query = """
-                SELECT DISTINCT c.*, 
+            query = f"""
+                SELECT DISTINCT c.*{_total_column(with_total)}, 
                     COALESCE(
                         json_agg(
                             json_build_object('id', t.id, 'name', t.name, 'color', t.color)
@@ -362,14 +768,22 @@ class Database:
                 query += f" AND EXISTS (SELECT 1 FROM customer_tags WHERE customer_id = c.id AND tag_id = ${param_count})"
                 params.append(tag_id)
             
-            query += f" GROUP BY c.id ORDER BY c.created_at DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
+            if cursor:
+                query += f" AND (c.created_at, c.id) < (${param_count + 1}, ${param_count + 2})"
+                params.extend(cursor)
+                param_count += 2
+                offset = 0
+            
+            query += f" GROUP BY c.id ORDER BY c.created_at DESC, c.id DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
             params.extend([limit, offset])
             
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
     
-    async def get_customers_count(self, tenant_id: str, search: Optional[str] = None, tag_id: Optional[str] = None) -> int:
-        """顧客数取得"""
+    async def get_customers_count(
+        self, tenant_id: str, search: Optional[str] = None, tag_id: Optional[str] = None, estimate: bool = False
+    ) -> int:
+        """顧客数取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
             query = "SELECT COUNT(DISTINCT c.id) FROM customers c WHERE c.tenant_id = $1"
             params = [tenant_id]
@@ -385,7 +799,7 @@ class Database:
                 query += f" AND EXISTS (SELECT 1 FROM customer_tags WHERE customer_id = c.id AND tag_id = ${param_count})"
                 params.append(tag_id)
             
-            return await conn.fetchval(query, *params)
+            return await self._count(conn, query, params, estimate)
     
     async def get_customer(self, customer_id: str, tenant_id: str) -> Optional[dict]:
         """顧客詳細取得"""
@@ -510,12 +924,13 @@ class Database:
     
     async def get_knowledge_articles(
         self, tenant_id: str, search: Optional[str] = None, category_id: Optional[str] = None,
-        tag_id: Optional[str] = None, limit: int = 50, offset: int = 0
+        tag_id: Optional[str] = None, limit: int = 50, offset: int = 0,
+        cursor: Optional[tuple] = None, with_total: bool = False
     ) -> List[dict]:
-        """ナレッジ記事一覧取得"""
+        """ナレッジ記事一覧取得（cursorは直前のページ最後の (relevance_score, created_at, id)）"""
         async with self.pool.acquire() as conn:
-            query = """
-                SELECT DISTINCT ka.*,
+            query = f"""
+                SELECT DISTINCT ka.*{_total_column(with_total)},
                     COALESCE(
                         json_agg(
                             json_build_object('id', t.id, 'name', t.name, 'color', t.color)
@@ -545,16 +960,23 @@ class Database:
                 query += f" AND EXISTS (SELECT 1 FROM knowledge_article_tags WHERE article_id = ka.id AND tag_id = ${param_count})"
                 params.append(tag_id)
             
-            query += f" GROUP BY ka.id ORDER BY ka.relevance_score DESC, ka.created_at DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
+            if cursor:
+                query += f" AND (ka.relevance_score, ka.created_at, ka.id) < (${param_count + 1}, ${param_count + 2}, ${param_count + 3})"
+                params.extend(cursor)
+                param_count += 3
+                offset = 0
+            
+            query += f" GROUP BY ka.id ORDER BY ka.relevance_score DESC, ka.created_at DESC, ka.id DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
             params.extend([limit, offset])
             
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
     
     async def get_knowledge_articles_count(
-        self, tenant_id: str, search: Optional[str] = None, category_id: Optional[str] = None, tag_id: Optional[str] = None
+        self, tenant_id: str, search: Optional[str] = None, category_id: Optional[str] = None, tag_id: Optional[str] = None,
+        estimate: bool = False
     ) -> int:
-        """ナレッジ記事数取得"""
+        """ナレッジ記事数取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
             query = "SELECT COUNT(DISTINCT ka.id) FROM knowledge_articles ka WHERE ka.tenant_id = $1"
             params = [tenant_id]
@@ -575,7 +997,7 @@ class Database:
                 query += f" AND EXISTS (SELECT 1 FROM knowledge_article_tags WHERE article_id = ka.id AND tag_id = ${param_count})"
                 params.append(tag_id)
             
-            return await conn.fetchval(query, *params)
+            return await self._count(conn, query, params, estimate)
     
     async def get_knowledge_article(self, article_id: str, tenant_id: str) -> Optional[dict]:
         """ナレッジ記事詳細取得"""
@@ -636,12 +1058,13 @@ class Database:
     
     async def get_customer_inquiries(
         self, tenant_id: str, customer_id: Optional[str] = None, status: Optional[str] = None,
-        priority: Optional[str] = None, limit: int = 50, offset: int = 0
+        priority: Optional[str] = None, limit: int = 50, offset: int = 0,
+        cursor: Optional[tuple] = None, with_total: bool = False
     ) -> List[dict]:
-        """お問い合わせ一覧取得"""
+        """お問い合わせ一覧取得（cursorは直前のページ最後の (created_at, id)）"""
         async with self.pool.acquire() as conn:
-            query = """
-                SELECT DISTINCT ci.*,
+            query = f"""
+                SELECT DISTINCT ci.*{_total_column(with_total)},
                     json_build_object(
                         'id', c.id, 'last_name', c.last_name, 'first_name', c.first_name,
                         'phone_number', c.phone_number
@@ -676,16 +1099,23 @@ class Database:
                 query += f" AND ci.priority = ${param_count}"
                 params.append(priority)
             
-            query += f" GROUP BY ci.id, c.id ORDER BY ci.created_at DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
+            if cursor:
+                query += f" AND (ci.created_at, ci.id) < (${param_count + 1}, ${param_count + 2})"
+                params.extend(cursor)
+                param_count += 2
+                offset = 0
+            
+            query += f" GROUP BY ci.id, c.id ORDER BY ci.created_at DESC, ci.id DESC LIMIT ${param_count + 1} OFFSET ${param_count + 2}"
             params.extend([limit, offset])
             
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
     
     async def get_customer_inquiries_count(
-        self, tenant_id: str, customer_id: Optional[str] = None, status: Optional[str] = None, priority: Optional[str] = None
+        self, tenant_id: str, customer_id: Optional[str] = None, status: Optional[str] = None, priority: Optional[str] = None,
+        estimate: bool = False
     ) -> int:
-        """お問い合わせ数取得"""
+        """お問い合わせ数取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
             query = "SELECT COUNT(*) FROM customer_inquiries WHERE tenant_id = $1"
             params = [tenant_id]
@@ -706,7 +1136,7 @@ class Database:
                 query += f" AND priority = ${param_count}"
                 params.append(priority)
             
-            return await conn.fetchval(query, *params)
+            return await self._count(conn, query, params, estimate)
     
     async def get_customer_inquiry(self, inquiry_id: str, tenant_id: str) -> Optional[dict]:
         """お問い合わせ詳細取得"""
@@ -814,31 +1244,36 @@ class Database:
     
     # ==================== AI架電キャンペーン ====================
     
-    async def get_call_campaigns(self, tenant_id: str, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[dict]:
+    async def get_call_campaigns(
+        self, tenant_id: str, status: Optional[str] = None, limit: int = 50, offset: int = 0, with_total: bool = False
+    ) -> List[dict]:
         """キャンペーン一覧取得"""
+        total_column = _total_column(with_total)
         async with self.pool.acquire() as conn:
             if status:
-                rows = await conn.fetch("""
-                    SELECT * FROM call_campaigns
+                rows = await conn.fetch(f"""
+                    SELECT *{total_column} FROM call_campaigns
                     WHERE tenant_id = $1 AND status = $2
                     ORDER BY created_at DESC
                     LIMIT $3 OFFSET $4
                 """, tenant_id, status, limit, offset)
             else:
-                rows = await conn.fetch("""
-                    SELECT * FROM call_campaigns
+                rows = await conn.fetch(f"""
+                    SELECT *{total_column} FROM call_campaigns
                     WHERE tenant_id = $1
                     ORDER BY created_at DESC
                     LIMIT $2 OFFSET $3
                 """, tenant_id, limit, offset)
             return [dict(row) for row in rows]
     
-    async def get_call_campaigns_count(self, tenant_id: str, status: Optional[str] = None) -> int:
-        """キャンペーン数取得"""
+    async def get_call_campaigns_count(self, tenant_id: str, status: Optional[str] = None, estimate: bool = False) -> int:
+        """キャンペーン数取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
             if status:
-                return await conn.fetchval("SELECT COUNT(*) FROM call_campaigns WHERE tenant_id = $1 AND status = $2", tenant_id, status)
-            return await conn.fetchval("SELECT COUNT(*) FROM call_campaigns WHERE tenant_id = $1", tenant_id)
+                return await self._count(
+                    conn, "SELECT COUNT(*) FROM call_campaigns WHERE tenant_id = $1 AND status = $2", [tenant_id, status], estimate
+                )
+            return await self._count(conn, "SELECT COUNT(*) FROM call_campaigns WHERE tenant_id = $1", [tenant_id], estimate)
     
     async def create_call_campaign(
         self, tenant_id: str, template_id: str, name: str, customer_ids: List[str], scheduled_at: Optional[datetime] = None
@@ -880,11 +1315,14 @@ class Database:
             query = f"UPDATE call_campaigns SET {set_clause}, updated_at = NOW() WHERE id = $1 AND tenant_id = $2"
             await conn.execute(query, *params)
     
-    async def get_campaign_logs(self, campaign_id: str, limit: int = 50, offset: int = 0) -> List[dict]:
-        """キャンペーンログ取得"""
+    async def get_campaign_logs(
+        self, campaign_id: str, limit: int = 50, offset: int = 0, cursor: Optional[tuple] = None,
+        with_total: bool = False
+    ) -> List[dict]:
+        """キャンペーンログ取得（cursorは直前のページ最後の (attempted_at, id)）"""
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT ccl.*,
+            query = f"""
+                SELECT ccl.*{_total_column(with_total)},
                     json_build_object(
                         'id', c.id, 'last_name', c.last_name, 'first_name', c.first_name,
                         'phone_number', c.phone_number
@@ -892,15 +1330,28 @@ class Database:
                 FROM call_campaign_logs ccl
                 JOIN customers c ON ccl.customer_id = c.id
                 WHERE ccl.campaign_id = $1
-                ORDER BY ccl.attempted_at DESC
+            """
+            if cursor:
+                query += """
+                AND (ccl.attempted_at, ccl.id) < ($2, $3)
+                ORDER BY ccl.attempted_at DESC, ccl.id DESC
+                LIMIT $4
+                """
+                rows = await conn.fetch(query, campaign_id, *cursor, limit)
+            else:
+                query += """
+                ORDER BY ccl.attempted_at DESC, ccl.id DESC
                 LIMIT $2 OFFSET $3
-            """, campaign_id, limit, offset)
+                """
+                rows = await conn.fetch(query, campaign_id, limit, offset)
             return [dict(row) for row in rows]
     
-    async def get_campaign_logs_count(self, campaign_id: str) -> int:
-        """キャンペーンログ数取得"""
+    async def get_campaign_logs_count(self, campaign_id: str, estimate: bool = False) -> int:
+        """キャンペーンログ数取得（estimate=Trueの場合は推定値）"""
         async with self.pool.acquire() as conn:
-            return await conn.fetchval("SELECT COUNT(*) FROM call_campaign_logs WHERE campaign_id = $1", campaign_id)
+            return await self._count(
+                conn, "SELECT COUNT(*) FROM call_campaign_logs WHERE campaign_id = $1", [campaign_id], estimate
+            )
     
     # ==================== テナント管理 ====================
     
@@ -932,4 +1383,7 @@ class Database:
     async def delete_tenant(self, tenant_id: str):
         """テナント削除"""
         async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM tenants WHERE id = $1", tenant_id)
\ No newline at end of file
+            await conn.execute("DELETE FROM tenants WHERE id = $1", tenant_id)
+
+# アプリケーション全体で共有するデータベース（接続プールは1つだけ）
+db = Database()
@@ -1,53 +1,214 @@
 import httpx
-from typing import Optional
+import importlib.util
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+# 文の区切りとみなす文字（この文字までを1文として音声合成に回す）
+SENTENCE_DELIMITERS = "。！？"
+
+ERROR_MESSAGE = "申し訳ありません。応答の生成中にエラーが発生しました。"
+
+# HTTPクライアントの接続プール設定
+DIFY_MAX_CONNECTIONS = int(os.getenv("DIFY_MAX_CONNECTIONS", "100"))
+DIFY_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("DIFY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+DIFY_KEEPALIVE_EXPIRY = float(os.getenv("DIFY_KEEPALIVE_EXPIRY", "60"))
+DIFY_CONNECT_TIMEOUT = float(os.getenv("DIFY_CONNECT_TIMEOUT", "5"))
+DIFY_READ_TIMEOUT = float(os.getenv("DIFY_READ_TIMEOUT", "60"))
+DIFY_HTTP2 = os.getenv("DIFY_HTTP2", "true").lower() == "true"
+
+# エンドポイントごとのプロセス共有HTTPクライアント
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_http_client(endpoint: str) -> httpx.AsyncClient:
+    """
+    エンドポイントに対応する共有HTTPクライアントを取得（なければ生成）
+
+    接続プールとkeep-aliveを通話・ターンをまたいで再利用し、
+    ターンごとのTCP/TLSハンドシェイクを省く。
+    """
+    key = endpoint.rstrip("/")
+    client = _http_clients.get(key)
+    if client is None or client.is_closed:
+        http2 = DIFY_HTTP2
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("Warning: h2 package is not installed. Dify client falls back to HTTP/1.1.")
+            http2 = False
+
+        client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=DIFY_MAX_CONNECTIONS,
+                max_keepalive_connections=DIFY_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=DIFY_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                DIFY_READ_TIMEOUT,
+                connect=DIFY_CONNECT_TIMEOUT
+            )
+        )
+        _http_clients[key] = client
+    return client
+
+async def close_http_clients():
+    """共有HTTPクライアントをすべて閉じる（シャットダウン時）"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+def split_sentences(text: str) -> List[str]:
+    """テキストを文単位（。！？区切り）に分割（stream_sentencesと同じ区切り方）"""
+    sentences: List[str] = []
+    start = 0
+    for i, char in enumerate(text):
+        if char in SENTENCE_DELIMITERS:
+            sentence = text[start:i + 1].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = i + 1
+    if text[start:].strip():
+        sentences.append(text[start:].strip())
+    return sentences
+
+def _is_conversation_missing(status_code: int, body: bytes) -> bool:
+    """エラー応答が「会話が存在しない」ことを示すかどうか"""
+    if status_code == 404:
+        return True
+    try:
+        error = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == "not_found" or "conversation not exists" in message
 
 class DifyClient:
-    def __init__(self, api_key: str, endpoint: str):
+    def __init__(
+        self,
+        api_key: str,
+        endpoint: str,
+        user: str = "voice-ai",
+        conversation_id: Optional[str] = None
+    ):
         """
         Dify APIクライアントを初期化
-        
+
         Args:
             api_key: Dify API Key
             endpoint: Dify APIエンドポイント
+            user: Dify側でユーザーを識別するID（会話はこのユーザーに紐づく）
+            conversation_id: 継続するDify会話ID（新規会話の場合はNone）
         """
         self.api_key = api_key
         self.endpoint = endpoint
+        self.user = user
+        self.conversation_id = conversation_id
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
-        
+
     async def get_response(self, text: str) -> str:
         """
         Difyを使用して応答を生成
-        
+
         Args:
             text: ユーザーの入力テキスト
-            
+
         Returns:
             str: 生成された応答テキスト
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        full_response = ""
+        async for chunk in self.stream_response(text):
+            full_response += chunk
+        return full_response
+
+    async def stream_response(self, text: str) -> AsyncIterator[str]:
+        """
+        Difyのストリーミング応答(SSE)を受信しながら差分テキストを順次返す
+
+        Args:
+            text: ユーザーの入力テキスト
+
+        Yields:
+            str: 応答テキストの差分
+        """
+        client = get_http_client(self.endpoint)
+        retried = False
+        while True:
+            async with client.stream(
+                "POST",
                 f"{self.endpoint}/chat-messages",
                 headers=self.headers,
                 json={
                     "inputs": {},
                     "query": text,
                     "response_mode": "streaming",
-                    "conversation_id": None
+                    "conversation_id": self.conversation_id or "",
+                    "user": self.user
                 }
-            )
-            
-            if response.status_code == 200:
-                # ストリーミングレスポンスを結合
-                full_response = ""
-                for line in response.iter_lines():
-                    if line:
-                        data = line.decode('utf-8')
-                        if data.startswith('data: '):
-                            chunk = data[6:]  # 'data: ' を除去
-                            full_response += chunk
-                return full_response
-            else:
-                return "申し訳ありません。応答の生成中にエラーが発生しました。"
\ No newline at end of file
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    # Dify側で会話が失効・削除されている場合は新規会話でやり直す
+                    if self.conversation_id and not retried and _is_conversation_missing(response.status_code, body):
+                        print(f"Dify conversation {self.conversation_id} expired. Starting a new conversation.")
+                        self.conversation_id = None
+                        retried = True
+                        continue
+                    yield ERROR_MESSAGE
+                    return
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+
+                    try:
+                        event = json.loads(line[5:].strip())
+                    except json.JSONDecodeError:
+                        continue
+
+                    # 以降のターンは同じ会話IDで新しい質問だけを送る
+                    if event.get("conversation_id"):
+                        self.conversation_id = event["conversation_id"]
+
+                    event_type = event.get("event")
+                    if event_type in ("message", "agent_message"):
+                        answer = event.get("answer")
+                        if answer:
+                            yield answer
+                    elif event_type == "message_end":
+                        return
+                    elif event_type == "error":
+                        print(f"Dify streaming error: {event.get('message')}")
+                        yield ERROR_MESSAGE
+                        return
+                return
+
+    async def stream_sentences(self, text: str) -> AsyncIterator[str]:
+        """
+        Difyの応答を文単位（。！？区切り）で順次返す
+
+        最初の文が揃った時点で返すため、LLMが残りを生成している間に
+        音声合成を開始できる。
+
+        Args:
+            text: ユーザーの入力テキスト
+
+        Yields:
+            str: 区切り文字までを含む1文
+        """
+        pending = ""
+        async for chunk in self.stream_response(text):
+            pending += chunk
+            start = 0
+            for i, char in enumerate(pending):
+                if char in SENTENCE_DELIMITERS:
+                    sentence = pending[start:i + 1].strip()
+                    if sentence:
+                        yield sentence
+                    start = i + 1
+            pending = pending[start:]
+
+        if pending.strip():
+            yield pending.strip()
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import shutil
+from typing import BinaryIO, List, Optional
+from google.cloud import vision
+import PIL.Image
+import PIL.ImageSequence
+from database import Database
+from models import FaxDocument
+
+# 同時に処理するFAXの数
+FAX_WORKERS = int(os.getenv("FAX_WORKERS", "2"))
+# 処理の最大試行回数と、再試行までの待ち時間（秒、試行ごとに倍増）
+FAX_MAX_ATTEMPTS = int(os.getenv("FAX_MAX_ATTEMPTS", "3"))
+FAX_RETRY_DELAY_SECONDS = float(os.getenv("FAX_RETRY_DELAY_SECONDS", "30"))
+# 処理待ちの確認間隔（他ワーカーが登録した分・再試行分の取得用、秒）
+FAX_POLL_SECONDS = float(os.getenv("FAX_POLL_SECONDS", "5"))
+# 処理中のまま止まった行を取得し直すまでの時間（秒）
+FAX_JOB_TIMEOUT_SECONDS = float(os.getenv("FAX_JOB_TIMEOUT_SECONDS", "600"))
+# アップロードをディスクへ書き込む単位
+FAX_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# OCRを利用できない場合に保存するテキスト
+OCR_UNAVAILABLE = "[OCR not available]"
+
+# Google Cloud Vision クライアント（遅延初期化）
+vision_client = None
+
+def get_vision_client():
+    """Google Cloud Vision クライアントを取得（遅延初期化）"""
+    global vision_client
+    if vision_client is None:
+        try:
+            vision_client = vision.ImageAnnotatorClient()
+        except Exception as e:
+            print(f"Warning: Google Cloud Vision not configured: {e}")
+            print("FAX OCR機能は無効です。Google Cloud認証情報を設定してください。")
+    return vision_client
+
+def save_upload(source: BinaryIO, path: str):
+    """アップロードされたファイルを分割して書き込む（全体をメモリに載せない）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        shutil.copyfileobj(source, f, FAX_UPLOAD_CHUNK_SIZE)
+    os.replace(temp, path)
+
+def convert_to_pdf(tiff_path: str, pdf_path: str) -> int:
+    """
+    TIFFをPDFに変換（複数ページのFAXは全ページを1つのPDFにまとめる）
+
+    Returns:
+        int: ページ数
+    """
+    with PIL.Image.open(tiff_path) as image:
+        pages: List[PIL.Image.Image] = [page.copy() for page in PIL.ImageSequence.Iterator(image)]
+    pages[0].save(pdf_path, "PDF", save_all=True, append_images=pages[1:])
+    return len(pages)
+
+def recognize_text(tiff_path: str) -> str:
+    """
+    TIFFの文字をOCRで認識
+
+    Returns:
+        str: 認識結果（Vision未設定の場合は空文字）
+    """
+    client = get_vision_client()
+    if not client:
+        return ""
+    with open(tiff_path, "rb") as f:
+        image = vision.Image(content=f.read())
+    response = client.text_detection(image=image)
+    if response.error.message:
+        raise RuntimeError(response.error.message)
+    return response.text_annotations[0].description if response.text_annotations else ""
+
+class FaxJobQueue:
+    def __init__(
+        self,
+        database: Database,
+        workers: int = FAX_WORKERS,
+        max_attempts: int = FAX_MAX_ATTEMPTS
+    ):
+        """
+        受信FAXの変換・OCRをバックグラウンドで処理するジョブキューを初期化
+
+        ジョブは fax_documents の行（status = 'queued'）そのもので、
+        複数のワーカー・プロセスが FOR UPDATE SKIP LOCKED で1件ずつ取得する。
+        変換とOCRはスレッドで実行し、通話のイベントループを止めない。
+        進捗は update_fax_status で converting → ocr → completed / failed と記録する。
+
+        Args:
+            database: ジョブを保存するデータベース
+            workers: 同時に処理するFAXの数
+            max_attempts: 最大試行回数（超えたら failed）
+        """
+        self.database = database
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def start(self):
+        """ワーカーを開始"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """ワーカーを停止（処理中のFAXはタイムアウト後に取得し直される）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(
+        self,
+        tenant_id: str,
+        sender_number: str,
+        receiver_number: str,
+        tiff_path: str,
+        pages: Optional[int] = None
+    ) -> FaxDocument:
+        """保存済みのTIFFを処理待ちとして登録"""
+        document = await self.database.enqueue_fax_document(
+            tenant_id=tenant_id,
+            sender_number=sender_number,
+            receiver_number=receiver_number,
+            tiff_path=tiff_path,
+            pages=pages
+        )
+        self.enqueued += 1
+        self._wakeup.set()
+        return document
+
+    async def _run(self):
+        while True:
+            try:
+                job = await self.database.claim_fax_job(FAX_JOB_TIMEOUT_SECONDS)
+            except Exception as e:
+                print(f"Warning: failed to claim FAX job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), FAX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._process(job)
+
+    async def _process(self, job: dict):
+        fax_id = str(job["id"])
+        tiff_path = job["tiff_path"]
+        pdf_path = f"{os.path.splitext(tiff_path)[0]}.pdf"
+        last_attempt = job["attempts"] >= self.max_attempts
+
+        try:
+            await asyncio.to_thread(convert_to_pdf, tiff_path, pdf_path)
+
+            await self.database.update_fax_status(fax_id, "ocr")
+            try:
+                ocr_text = await asyncio.to_thread(recognize_text, tiff_path)
+            except Exception as e:
+                # OCRの一時的な失敗は再試行し、最後の試行ではOCRなしで完了させる
+                if not last_attempt:
+                    raise
+                print(f"Warning: OCR processing skipped: {e}")
+                ocr_text = None
+
+            await self.database.complete_fax_job(
+                fax_id, pdf_path, OCR_UNAVAILABLE if ocr_text is None else ocr_text
+            )
+            self.completed += 1
+
+        except Exception as e:
+            print(f"Error processing FAX {fax_id} (attempt {job['attempts']}): {e}")
+            try:
+                if last_attempt:
+                    await self.database.update_fax_status(fax_id, "failed", str(e))
+                    self.failed += 1
+                else:
+                    delay = FAX_RETRY_DELAY_SECONDS * 2 ** (job["attempts"] - 1)
+                    await self.database.retry_fax_job(fax_id, str(e), delay)
+                    self.retried += 1
+            except Exception as update_error:
+                # 状態を更新できなくてもタイムアウト後に取得し直される
+                print(f"Warning: failed to update FAX job {fax_id}: {update_error}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed
+        }
@@ -1,21 +1,30 @@
 import os
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, File, UploadFile, Form, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Literal
 import asyncio
 import json
 from datetime import datetime, timedelta
-import azure.cognitiveservices.speech as speechsdk
-from database import Database
-from auth import get_current_tenant
+from zoneinfo import ZoneInfo
+from database import db
+from auth import get_current_tenant, tenant_cache, start_tenant_cache_listener, close_tenant_cache_listener
 from models import CallSession, Message, FaxDocument
 from vad import VoiceActivityDetector
-from dify_client import DifyClient
-from google.cloud import vision
-import PIL.Image
-from pdf2image import convert_from_bytes
-import io
+from vad_scheduler import VADBatchScheduler
+from dify_client import DifyClient, close_http_clients, split_sentences, ERROR_MESSAGE
+from response_cache import response_cache, start_response_cache_listener, close_response_cache_listener
+from speech_engine import SpeechEngine, SynthesizerPool, FramePacer, DEFAULT_LANGUAGE, DEFAULT_VOICE, SAMPLE_RATE, TTS_STREAMING
+from tts_cache import TTSCache, tenant_phrases
+from audio_buffer import UtteranceBuffer
+from write_behind import WriteBehindWriter
+from active_calls import active_calls, ACTIVE_STATUSES
+from session_registry import create_session_registry
+from call_router import CallRouter
+from fax_jobs import FaxJobQueue, save_upload
+from pagination import CountMode, decode_cursor, next_cursor, resolve_total, with_total
 
 app = FastAPI(title="Voice AI Call System")
 
@@ -38,28 +47,47 @@ app.include_router(campaigns.router)
 app.include_router(tenants.router)
 app.include_router(settings.router)
 
-# データベース接続
-db = Database()
+# 会話メッセージ・DTMF入力の一括書き込み（リアルタイム処理からDB往復を外す）
+writer = WriteBehindWriter(db)
 
-# VAD検出器
+# VAD検出器（全通話の推論をまとめてバッチ実行）
 vad = VoiceActivityDetector()
+vad_scheduler = VADBatchScheduler(
+    vad,
+    interval_ms=float(os.getenv("VAD_BATCH_INTERVAL_MS", "5"))
+)
 
-# アクティブな通話セッション
+# このワーカーで接続中の通話セッション（WebSocket・音声エンジンなどの実体）
 active_sessions: Dict[str, Dict] = {}
 
-# Google Cloud Vision クライアント（遅延初期化）
-vision_client = None
+# 接続中の通話がどのワーカーにあるか（SESSION_REGISTRY=postgres で全ワーカー共有）
+session_registry = create_session_registry(db)
 
-def get_vision_client():
-    """Google Cloud Vision クライアントを取得（遅延初期化）"""
-    global vision_client
-    if vision_client is None:
-        try:
-            vision_client = vision.ImageAnnotatorClient()
-        except Exception as e:
-            print(f"Warning: Google Cloud Vision not configured: {e}")
-            print("FAX OCR機能は無効です。Google Cloud認証情報を設定してください。")
-    return vision_client
+# 通話の終了・DTMFを、WebSocketを保持するワーカーへ届ける
+call_router = CallRouter(
+    db,
+    session_registry,
+    handler=lambda call_id, event: handle_call_event(call_id, event),
+    is_local=lambda call_id: call_id in active_sessions
+)
+
+# 通話中一覧の購読者へ接続維持のコメントを送る間隔（秒）
+ACTIVE_CALLS_KEEPALIVE_SECONDS = float(os.getenv("ACTIVE_CALLS_KEEPALIVE_SECONDS", "15"))
+
+# テナント単位の接続済みSynthesizerプール
+synthesizer_pool = SynthesizerPool()
+
+# 定型文（挨拶・担当者呼び出し・エラー応答など）の合成音声キャッシュ
+tts_cache = TTSCache()
+
+# 通話統計の時系列を区切るタイムゾーン（リクエストで省略した場合）
+STATS_TIMEZONE = os.getenv("STATS_TIMEZONE", "Asia/Tokyo")
+
+# 音声認識モード（streaming: フレーム単位の連続認識 / once: 発話終了後に一括認識）
+STT_MODE = os.getenv("STT_MODE", "streaming")
+
+# 受信FAXのPDF変換・OCR（Webhookは登録だけして即座に応答する）
+fax_jobs = FaxJobQueue(db)
 
 class CallRequest(BaseModel):
     from_number: str
@@ -90,10 +118,43 @@ class DtmfEvent(BaseModel):
 
 @app.on_event("startup")
 async def startup():
+    # 全ルーター・認証で共有する接続プール
     await db.connect()
+    app.state.db = db
+    await rollup_pending_call_stats()
+    await writer.start()
+    await fax_jobs.start()
+    await vad_scheduler.start()
+    await session_registry.start()
+    await call_router.start()
+    # 通話中一覧をメモリに読み込み、以降は差分を配信
+    await active_calls.start(db, session_registry)
+    # 他ワーカーでのテナント更新・削除を認証キャッシュに反映
+    app.state.tenant_listener = await start_tenant_cache_listener(db)
+    # 他ワーカーでのナレッジ記事の変更を応答キャッシュに反映
+    app.state.response_cache_listener = await start_response_cache_listener(db)
+    # 定型文の事前合成は起動を待たせずに裏で行う
+    app.state.prewarm_tenant_phrases = prewarm_tenant_phrases
+    app.state.prewarm_task = asyncio.create_task(prewarm_all_tenants())
 
 @app.on_event("shutdown")
 async def shutdown():
+    if not app.state.prewarm_task.done():
+        app.state.prewarm_task.cancel()
+    # 通話中のセッションを閉じ、応答途中のメッセージもキューに積ませる
+    for call_id in list(active_sessions):
+        await close_session(call_id)
+    await vad_scheduler.stop()
+    await active_calls.stop()
+    await call_router.stop()
+    await session_registry.stop()
+    synthesizer_pool.close()
+    await close_http_clients()
+    await close_tenant_cache_listener(app.state.tenant_listener)
+    await close_response_cache_listener(app.state.response_cache_listener)
+    await fax_jobs.stop()
+    # キューに残ったメッセージを書き込んでから切断
+    await writer.stop()
     await db.disconnect()
 
 # ==================== ヘルスチェック ====================
@@ -105,7 +166,17 @@ async def health_check():
         "status": "ok",
         "timestamp": datetime.utcnow().isoformat(),
         "service": "python-backend",
-        "database": "connected" if db.pool else "disconnected"
+        "database": "connected" if db.pool else "disconnected",
+        "database_pool": db.pool_stats(),
+        "vad": vad_scheduler.stats(),
+        "tts_cache": tts_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "tenant_cache": tenant_cache.stats(),
+        "write_behind": writer.stats(),
+        "active_calls": active_calls.stats(),
+        "session_registry": session_registry.stats(),
+        "call_router": call_router.stats(),
+        "fax_jobs": fax_jobs.stats()
     }
 
 # ==================== Node.jsバックエンド連携API ====================
@@ -130,6 +201,7 @@ async def create_call_session(
             to_number=request.to_number,
             status="ringing"
         )
+        active_calls.add(dict(session))
         
         return {
             "status": "success",
@@ -168,9 +240,18 @@ async def end_call_session(
             end_time=end_time
         )
         
-        # アクティブセッションから削除
-        if call_id in active_sessions:
-            del active_sessions[call_id]
+        if request.status in ACTIVE_STATUSES:
+            active_calls.update(call_id, status=request.status, end_time=end_time)
+        else:
+            active_calls.remove(call_id)
+            # 通話統計の時間別集計に足し込む（失敗しても統計は未集計の通話として数えられる）
+            try:
+                await db.rollup_call_stats(call_id)
+            except Exception as e:
+                print(f"Warning: failed to roll up call statistics: {e}")
+        
+        # 通話を保持するワーカー（別ワーカーなら転送）でセッションを解放
+        await call_router.dispatch(call_id, {"type": "end"})
         
         return {
             "status": "success",
@@ -201,14 +282,17 @@ async def record_dtmf(
         if not session:
             raise HTTPException(status_code=404, detail="Call session not found")
         
-        # DTMF入力を保存
+        # DTMF入力を保存（一括書き込みキューに積む）
         timestamp = datetime.fromisoformat(request.timestamp.replace('Z', '+00:00')) if request.timestamp else None
-        await db.save_dtmf(
+        await writer.save_dtmf(
             call_id=call_id,
             digit=request.digit,
             timestamp=timestamp
         )
         
+        # 通話を保持するワーカー（別ワーカーなら転送）のセッションに伝える
+        await call_router.dispatch(call_id, {"type": "dtmf", "digit": request.digit})
+        
         return {
             "status": "success",
             "call_id": call_id,
@@ -256,34 +340,85 @@ async def get_tenant_greeting(
             detail=f"Failed to get greeting: {str(e)}"
         )
 
+@app.get("/api/tenants/{tenant_id}/greeting/audio")
+async def get_tenant_greeting_audio(
+    tenant_id: str,
+    tenant = Depends(get_current_tenant)
+):
+    """
+    テナントの挨拶メッセージの合成音声を取得（Node.jsバックエンドから呼ばれる）
+    
+    事前合成済みのキャッシュがあれば合成せずに返す。
+    合成にはテナントのAzureキーを使うため、認証したテナント自身の分だけを返す。
+    """
+    try:
+        if str(tenant["id"]) != tenant_id:
+            raise HTTPException(status_code=403, detail="Access to another tenant's greeting is not allowed")
+        
+        tenant_settings = await db.get_tenant_settings(tenant_id) or {}
+        greeting = tenant_settings.get("greeting_message") or "お電話ありがとうございます。AIアシスタントが対応いたします。"
+        
+        engine = create_speech_engine(tenant, tenant_settings)
+        try:
+            audio = b"".join([
+                await engine.synthesize(sentence, cache=True)
+                for sentence in split_sentences(greeting)
+            ])
+        finally:
+            await engine.close()
+        
+        media_type = f"audio/L16; rate={SAMPLE_RATE}" if TTS_STREAMING else "audio/wav"
+        return Response(content=audio, media_type=media_type)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get greeting audio: {str(e)}"
+        )
+
 # ==================== フロントエンド用API ====================
 
 @app.get("/api/calls")
 async def get_call_history(
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: CountMode = "exact",
     tenant = Depends(get_current_tenant)
 ):
     """
     通話履歴一覧を取得（フロントエンドから呼ばれる）
+    
+    cursorを指定した場合はOFFSETを使わずに前ページの続きから取得する。
+    countで総件数の取得方法（exact / estimate / none）を選べる。
     """
     try:
+        position = decode_cursor(cursor)
         sessions = await db.get_call_sessions(
             tenant_id=tenant.id,
             limit=limit,
-            offset=offset
+            offset=offset,
+            cursor=position,
+            with_total=with_total(count, position)
         )
         
-        total = await db.get_call_sessions_count(tenant.id)
+        total = await resolve_total(
+            count, sessions, lambda estimate: db.get_call_sessions_count(tenant.id, estimate=estimate)
+        )
         
         return {
             "status": "success",
             "calls": sessions,
             "total": total,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor(sessions, limit, ["start_time", "id"])
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -296,19 +431,11 @@ async def get_active_calls(
 ):
     """
     アクティブな通話一覧を取得（フロントエンドから呼ばれる）
+    
+    メモリ上の通話中一覧から返す。継続的な監視には /api/calls/active/stream を使う。
     """
     try:
-        calls = await db.get_active_calls(tenant.id)
-        
-        # アクティブセッション情報も追加
-        for call in calls:
-            call_id = call.get('id')
-            if call_id in active_sessions:
-                call['is_connected'] = True
-                call['has_ai_session'] = True
-            else:
-                call['is_connected'] = False
-                call['has_ai_session'] = False
+        calls = active_calls.calls(tenant.id)
         
         return {
             "status": "success",
@@ -322,6 +449,40 @@ async def get_active_calls(
             detail=f"Failed to get active calls: {str(e)}"
         )
 
+@app.get("/api/calls/active/stream")
+async def stream_active_calls(
+    tenant = Depends(get_current_tenant)
+):
+    """
+    アクティブな通話の変化をServer-Sent Eventsで配信（フロントエンドの監視画面向け）
+    
+    接続直後に snapshot（全件）、以降は call_started / call_updated / call_ended を送る。
+    """
+    async def events():
+        # レスポンスが送られなかった場合に購読が残らないよう、生成を始めてから購読する
+        queue = active_calls.subscribe(tenant.id)
+        try:
+            yield format_sse({"event": "snapshot", "calls": jsonable_encoder(active_calls.calls(tenant.id))})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), ACTIVE_CALLS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            active_calls.unsubscribe(tenant.id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def format_sse(event: Dict) -> str:
+    """イベントをSSEの形式に変換（event行にイベント名、data行にJSON）"""
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
 @app.get("/api/calls/{call_id}")
 async def get_call_detail(
     call_id: str,
@@ -387,10 +548,16 @@ async def get_call_messages(
 async def get_statistics(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    interval: Optional[Literal["hour", "day"]] = None,
+    timezone: Optional[str] = None,
     tenant = Depends(get_current_tenant)
 ):
     """
     通話統計を取得（フロントエンドから呼ばれる）
+    
+    時間別の集計と未集計の通話から求めるため、履歴が増えても応答時間は変わらない。
+    intervalを指定した場合は時間帯ごとの推移（series）も返す。
+    timezoneはUTCとの時差が1時間単位のもののみ指定できる。
     """
     try:
         start_dt = None
@@ -407,18 +574,46 @@ async def get_statistics(
             end_date=end_dt
         )
         
-        return {
+        result = {
             "status": "success",
             "statistics": stats
         }
         
+        if interval:
+            time_zone = timezone or STATS_TIMEZONE
+            try:
+                zone = ZoneInfo(time_zone)
+            except Exception:
+                raise HTTPException(status_code=400, detail=f"Invalid timezone: {time_zone}")
+            # 時間別集計を束ねるため、UTCとの時差が1時間単位のタイムゾーンのみ扱える
+            year = datetime.utcnow().year
+            if any(zone.utcoffset(datetime(year, month, 1)).total_seconds() % 3600 for month in (1, 7)):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Timezone offset must be a whole number of hours: {time_zone}"
+                )
+            
+            result["interval"] = interval
+            result["timezone"] = time_zone
+            result["series"] = await db.get_call_statistics_series(
+                tenant_id=tenant.id,
+                interval=interval,
+                time_zone=time_zone,
+                start_date=start_dt,
+                end_date=end_dt
+            )
+        
+        return result
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to get statistics: {str(e)}"
         )
 
-@app.post("/api/fax/webhook/inbound")
+@app.post("/api/fax/webhook/inbound", status_code=202)
 async def fax_webhook_inbound(
     fax_id: str = Form(...),
     sender_number: str = Form(...),
@@ -428,51 +623,27 @@ async def fax_webhook_inbound(
     tiff_file: UploadFile = File(...),
     tenant = Depends(get_current_tenant)
 ):
+    """
+    受信FAXを保存して処理待ちに登録（PDF変換・OCRはバックグラウンドで実行）
+    
+    処理状況は fax_documents.status（queued → converting → ocr → completed / failed）で確認する。
+    """
     try:
-        # TIFFファイルを読み込み
-        tiff_content = await tiff_file.read()
+        # TIFFファイルを分割して保存
+        tiff_path = f"storage/fax/{tenant.id}/{fax_id}.tiff"
+        await asyncio.to_thread(save_upload, tiff_file.file, tiff_path)
         
-        # ファイル保存パスを生成
-        base_path = f"storage/fax/{tenant.id}/{fax_id}"
-        os.makedirs(os.path.dirname(base_path), exist_ok=True)
-        
-        # TIFFファイルを保存
-        tiff_path = f"{base_path}.tiff"
-        with open(tiff_path, "wb") as f:
-            f.write(tiff_content)
-            
-        # TIFFをPDFに変換
-        image = PIL.Image.open(io.BytesIO(tiff_content))
-        pdf_path = f"{base_path}.pdf"
-        image.save(pdf_path, "PDF")
-        
-        # OCR処理
-        ocr_text = ""
-        try:
-            client = get_vision_client()
-            if client:
-                image = vision.Image(content=tiff_content)
-                response = client.text_detection(image=image)
-                ocr_text = response.text_annotations[0].description if response.text_annotations else ""
-        except Exception as e:
-            print(f"Warning: OCR processing skipped: {e}")
-            ocr_text = "[OCR not available]"
-        
-        # データベースに保存
-        document = await db.save_fax_document(
+        document = await fax_jobs.enqueue(
             tenant_id=tenant.id,
-            direction="inbound",
             sender_number=sender_number,
             receiver_number=receiver_number,
-            status="completed",
             tiff_path=tiff_path,
-            pdf_path=pdf_path,
-            ocr_text=ocr_text
+            pages=pages
         )
         
         return {
-            "status": "success",
-            "message": "FAX received successfully",
+            "status": "accepted",
+            "message": "FAX queued for processing",
             "document_id": document.id
         }
         
@@ -520,98 +691,372 @@ async def websocket_endpoint(
         if not session:
             raise HTTPException(status_code=404, detail="Call session not found")
         
+        # 同じワーカーへの再接続では、前の接続のセッションを閉じてから置き換える
+        if call_id in active_sessions:
+            await close_session(call_id)
+        
+        # 通話単位の音声エンジン（認識器・合成器を通話中使い回す）
+        tenant_settings = await db.get_tenant_settings(tenant.id) or {}
+        engine = create_speech_engine(tenant, tenant_settings)
+        await engine.start(streaming=STT_MODE == "streaming")
+        recognizer = engine.recognizer
+        vad_scheduler.open_stream(call_id)
+        
+        # 再接続時は保存済みのDify会話IDから会話を継続する
         active_sessions[call_id] = {
             "websocket": websocket,
-            "speech_config": speechsdk.SpeechConfig(
-                subscription=tenant.azure_speech_key,
-                region=tenant.azure_speech_region
-            ),
+            "tenant_id": tenant.id,
+            "engine": engine,
             "dify_client": DifyClient(
-                api_key=tenant.dify_api_key,
-                endpoint=tenant.dify_endpoint
+                api_key=tenant["dify_api_key"],
+                endpoint=tenant["dify_endpoint"],
+                user=call_id,
+                conversation_id=session.get("dify_conversation_id")
             ),
-            "buffer": [],
-            "is_speaking": False
+            "conversation_id": session.get("dify_conversation_id"),
+            # 連続認識では音声は認識器に流すため、発話の長さだけを数える
+            "utterance": UtteranceBuffer(sample_rate=SAMPLE_RATE, store=not recognizer),
+            "is_speaking": False,
+            # キャッシュから再生する定型文
+            "cached_phrases": set(tenant_phrases(tenant_settings)),
+            # 応答（認識・Dify・音声合成）を受信ループと並行して実行するタスク
+            "respond_task": None,
+            # 発話中に最大長で区切った音声の認識タスク（一括認識時。発話終了後の応答でまとめる）
+            "segments": [],
+            # 応答の音声をクライアントへ送信済みか（バージイン通知の要否）
+            "audio_sent": False
         }
+        await call_router.claim(call_id, tenant.id)
+        active_calls.update(call_id, is_connected=True, has_ai_session=True)
         
-        # 音声ストリーム処理ループ
+        # 音声ストリーム処理ループ（応答中も受信を止めない）
         while True:
             data = await websocket.receive_bytes()
+            session = active_sessions.get(call_id)
+            if session is None or session["websocket"] is not websocket:
+                # 通話終了・再接続でこの接続のセッションが閉じられた
+                break
+            utterance = session["utterance"]
+            
+            # 認識器へは到着したフレームをそのまま流す
+            if recognizer:
+                recognizer.write(data)
             
             # VADで発話区間検出
-            is_speech = vad.detect(data)
-            session = active_sessions[call_id]
+            is_speech = await vad_scheduler.detect(call_id, data)
             
             if is_speech:
-                session["buffer"].append(data)
                 if not session["is_speaking"]:
                     session["is_speaking"] = True
+                    utterance.start()
+                    # 応答中に話し始めた場合は応答を打ち切る（バージイン）
+                    await interrupt_response(session)
+                
+                if utterance.append(data):
+                    # 最大長に達した長い発話は区切って認識だけを先に進める
+                    # （話し続けている間は応答せず、発話終了後に1回だけ応答する）
+                    audio = utterance.take()
+                    utterance.start(pre_roll=False)
+                    if not recognizer:
+                        session["segments"].append(
+                            asyncio.create_task(session["engine"].recognize(audio))
+                        )
                     
             elif session["is_speaking"]:
                 # 発話終了を検出
                 session["is_speaking"] = False
+                start_response(call_id, session, utterance.take())
                 
-                # 音声認識実行
-                audio_buffer = b"".join(session["buffer"])
-                text = await recognize_speech(audio_buffer, session["speech_config"])
-                
-                # Difyで応答生成
-                response = await session["dify_client"].get_response(text)
-                
-                # 音声合成
-                audio_response = await synthesize_speech(
-                    response,
-                    session["speech_config"]
-                )
-                
-                # クライアントに送信
-                await websocket.send_bytes(audio_response)
-                
-                # ログ保存
-                await db.save_message(
-                    call_id=call_id,
-                    content=text,
-                    type="user"
-                )
-                await db.save_message(
-                    call_id=call_id,
-                    content=response,
-                    type="ai"
-                )
-                
-                session["buffer"] = []
+            else:
+                utterance.feed(data)
                 
     except WebSocketDisconnect:
-        if call_id in active_sessions:
-            del active_sessions[call_id]
+        await close_session(call_id, websocket)
     except Exception as e:
         print(f"Error in websocket connection: {e}")
-        if call_id in active_sessions:
-            del active_sessions[call_id]
-
-async def recognize_speech(audio_data: bytes, speech_config: speechsdk.SpeechConfig) -> str:
-    """Azure Speech-to-Textで音声認識を実行"""
-    audio_input = speechsdk.AudioInputStream(audio_data)
-    speech_recognizer = speechsdk.SpeechRecognizer(
-        speech_config=speech_config,
-        audio_config=speechsdk.AudioConfig(stream=audio_input)
+        await close_session(call_id, websocket)
+
+def start_response(
+    call_id: str,
+    session: Dict,
+    audio: Optional[memoryview]
+):
+    """発話の処理を受信ループとは別のタスクで開始"""
+    segments, session["segments"] = session["segments"], []
+    session["respond_task"] = asyncio.create_task(
+        process_utterance(call_id, session, audio, segments)
     )
+
+async def interrupt_response(session: Dict):
+    """
+    実行中の応答を取り消す
+    
+    Difyのストリーミング受信と音声合成を中断して接続・合成器を解放し、
+    音声を送信済みの場合は再生を止めるようクライアントへ通知する。
+    """
+    task = session["respond_task"]
+    if not task or task.done():
+        return
+    
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    
+    # 認識・応答生成中で音声をまだ送っていなければ止める再生はない
+    if not session["audio_sent"]:
+        return
+    session["audio_sent"] = False
+    try:
+        await session["websocket"].send_json({"event": "barge_in"})
+    except Exception as e:
+        print(f"Warning: failed to send barge-in event: {e}")
+
+async def process_utterance(
+    call_id: str,
+    session: Dict,
+    audio: Optional[memoryview],
+    segments: Optional[List[asyncio.Task]] = None
+):
+    """
+    1発話分の音声を認識し、Difyの応答を音声で返してログを保存
+    
+    Args:
+        call_id: 通話ID
+        session: アクティブセッション
+        audio: 発話音声（連続認識の場合はNone）
+        segments: 発話中に最大長で区切った部分の認識タスク（発話順）
+    """
+    segments = segments or []
+    try:
+        recognizer = session["engine"].recognizer
+        
+        # 音声認識結果を取得
+        if recognizer:
+            # 連続認識では区切った部分も含め、発話全体の確定結果がまとめて返る
+            text = await recognizer.collect_utterance()
+        else:
+            texts = await asyncio.gather(*segments, return_exceptions=True)
+            for error in [t for t in texts if isinstance(t, Exception)]:
+                print(f"Error recognizing utterance segment for call {call_id}: {error}")
+            texts = [t for t in texts if isinstance(t, str)]
+            if audio:
+                texts.append(await session["engine"].recognize(audio))
+            text = "".join(texts)
+        
+        if not text:
+            return
+        
+        # Difyで応答生成しながら文単位で音声合成・送信
+        # 割り込まれた場合も、それまでに話した分は記録する
+        spoken: List[str] = []
+        try:
+            await stream_ai_response(session, text, spoken)
+        finally:
+            await save_turn(call_id, session, text, "".join(spoken))
+            
+    except asyncio.CancelledError:
+        for segment in segments:
+            segment.cancel()
+        raise
+    except Exception as e:
+        print(f"Error in response for call {call_id}: {e}")
+
+async def save_turn(call_id: str, session: Dict, text: str, response: str):
+    """Difyの会話IDと1ターン分のメッセージを保存"""
+    try:
+        # Difyの会話IDが変わった場合は保存
+        conversation_id = session["dify_client"].conversation_id
+        if conversation_id != session["conversation_id"]:
+            session["conversation_id"] = conversation_id
+            await db.update_call_conversation_id(call_id, conversation_id)
+        
+        # ログ保存（一括書き込みキューに積む）
+        await writer.save_message(
+            call_id=call_id,
+            content=text,
+            type="user"
+        )
+        if response:
+            await writer.save_message(
+                call_id=call_id,
+                content=response,
+                type="ai"
+            )
+    except Exception as e:
+        print(f"Failed to save messages for call {call_id}: {e}")
+
+async def stream_ai_response(session: Dict, text: str, spoken: List[str]) -> str:
+    """
+    Difyの応答を文単位で受け取り、生成途中から順次音声合成して送信
+    
+    LLMの受信と音声合成・送信を別タスクで並行させ、
+    最初の1文が揃った時点で発話を開始する。
+    応答キャッシュにある質問はDifyに問い合わせず、合成音声もキャッシュから返す。
     
-    result = await speech_recognizer.recognize_once_async()
-    if result.reason == speechsdk.ResultReason.RecognizedSpeech:
-        return result.text
-    return ""
-
-async def synthesize_speech(text: str, speech_config: speechsdk.SpeechConfig) -> bytes:
-    """Azure Text-to-Speechで音声合成を実行"""
-    speech_synthesizer = speechsdk.SpeechSynthesizer(
-        speech_config=speech_config
+    Args:
+        session: アクティブセッション
+        text: ユーザーの発話テキスト
+        spoken: 送信し終えた文を順に追加するリスト
+    
+    Returns:
+        str: 送信した応答テキスト
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    cached_response = await response_cache.get(session["tenant_id"], text)
+    # 会話の文脈に依存しない（Dify会話の最初の）質問の応答だけをキャッシュする
+    cacheable = cached_response is None and session["dify_client"].conversation_id is None
+    
+    async def produce():
+        try:
+            if cached_response is not None:
+                for sentence in split_sentences(cached_response):
+                    await queue.put((sentence, True))
+            else:
+                async for sentence in session["dify_client"].stream_sentences(text):
+                    await queue.put((sentence, sentence in session["cached_phrases"]))
+        finally:
+            await queue.put(None)
+    
+    producer = asyncio.create_task(produce())
+    session["audio_sent"] = False
+    # 応答全体（文をまたいで）で再生速度に合わせて送信する
+    pacer = FramePacer()
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            sentence, cache = item
+            if TTS_STREAMING:
+                # 合成途中から固定長フレームで送信
+                async for frame in session["engine"].synthesize_stream(sentence, cache=cache):
+                    await pacer.wait()
+                    await session["websocket"].send_bytes(frame)
+                    session["audio_sent"] = True
+            else:
+                audio = await session["engine"].synthesize(sentence, cache=cache)
+                if audio:
+                    await session["websocket"].send_bytes(audio)
+                    session["audio_sent"] = True
+            spoken.append(sentence)
+        await producer
+        
+        response = "".join(spoken)
+        if cacheable and response and ERROR_MESSAGE not in response:
+            await response_cache.put(session["tenant_id"], text, response)
+    finally:
+        # 割り込み時はDifyのストリーミング受信も打ち切って接続を解放する
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+    
+    return "".join(spoken)
+
+def create_speech_engine(tenant, tenant_settings: Dict) -> SpeechEngine:
+    """テナント設定（言語・音声・話速・音量）に従った音声エンジンを生成"""
+    return SpeechEngine(
+        synthesizer_pool,
+        subscription=tenant["azure_speech_key"],
+        region=tenant["azure_speech_region"],
+        language=tenant_settings.get("azure_speech_language") or DEFAULT_LANGUAGE,
+        voice=tenant_settings.get("voice_name") or tenant_settings.get("azure_speech_voice") or DEFAULT_VOICE,
+        rate=tenant_settings.get("speech_rate") or 1.0,
+        volume=tenant_settings.get("volume"),
+        cache=tts_cache
     )
+
+async def prewarm_tenant_phrases(tenant_id: str):
+    """テナントの定型文を事前合成してキャッシュに載せる（起動時・設定変更時）"""
+    try:
+        tenant = await db.get_tenant(tenant_id)
+        if not tenant or not tenant["azure_speech_key"]:
+            return
+        tenant_settings = await db.get_tenant_settings(tenant_id) or {}
+        
+        engine = create_speech_engine(tenant, tenant_settings)
+        try:
+            await engine.prewarm(tenant_phrases(tenant_settings))
+        finally:
+            await engine.close()
+    except Exception as e:
+        print(f"Warning: failed to prewarm TTS cache for tenant {tenant_id}: {e}")
+
+async def prewarm_all_tenants():
+    """全テナントの定型文を事前合成し、ディスクキャッシュを上限内に整理"""
+    try:
+        tenants = await db.get_all_tenants()
+    except Exception as e:
+        print(f"Warning: failed to load tenants for TTS prewarm: {e}")
+        return
+    for tenant in tenants:
+        await prewarm_tenant_phrases(tenant["id"])
+    await tts_cache.prune()
+
+async def handle_call_event(call_id: str, event: Dict):
+    """
+    このワーカーが保持する通話への制御イベントを処理（他ワーカーからの転送分を含む）
+    
+    end: 通話終了 / release: 別のワーカーへ再接続 / dtmf: DTMF入力
+    """
+    if event["type"] in ("end", "release"):
+        await close_session(call_id)
+    elif event["type"] == "dtmf":
+        session = active_sessions.get(call_id)
+        if session:
+            # キー操作があった場合は再生中の応答を止める
+            await interrupt_response(session)
+
+async def rollup_pending_call_stats():
+    """前回の停止までに集計できなかった終了済み通話を時間別集計に足し込む"""
+    try:
+        await db.rollup_call_stats()
+    except Exception as e:
+        print(f"Warning: failed to roll up pending call statistics: {e}")
+
+async def close_session(call_id: str, websocket: Optional[WebSocket] = None):
+    """
+    アクティブセッションを削除し、音声エンジンのリソースを解放
     
-    result = await speech_synthesizer.speak_text_async(text)
-    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-        return result.audio_data
-    return b""
+    websocketを指定した場合は、その接続のセッションのときだけ閉じる
+    （再接続で置き換わった後に古い接続の切断処理が新しいセッションを閉じないため）。
+    """
+    session = active_sessions.get(call_id)
+    if not session or (websocket is not None and session["websocket"] is not websocket):
+        return
+    del active_sessions[call_id]
+    
+    active_calls.update(call_id, is_connected=False, has_ai_session=False)
+    try:
+        await session_registry.unregister(call_id)
+    except Exception as e:
+        print(f"Warning: failed to unregister session: {e}")
+    vad_scheduler.close_stream(call_id)
+    
+    for segment in session.get("segments", []):
+        segment.cancel()
+    task = session.get("respond_task")
+    if task and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    engine = session.get("engine")
+    if engine:
+        await engine.close()
+    
+    # 別の処理から閉じた場合は接続も閉じ、受信ループを終わらせる
+    if websocket is None:
+        try:
+            await session["websocket"].close()
+        except Exception:
+            pass
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,15 @@
+-- WebSocket接続中の通話セッションの所在（複数ワーカー・複数ノードで共有）
+-- SESSION_REGISTRY=postgres の場合に使用する
+-- 各ワーカーが heartbeat_at を定期的に更新し、更新が途絶えた行は無効とみなして削除する
+
+CREATE TABLE IF NOT EXISTS call_session_registry (
+    call_id UUID PRIMARY KEY REFERENCES call_sessions(id) ON DELETE CASCADE,
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    worker_id VARCHAR(255) NOT NULL, -- ホスト名:プロセスID または WORKER_ID
+    connected_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_session_registry_tenant_id ON call_session_registry(tenant_id);
+CREATE INDEX IF NOT EXISTS idx_call_session_registry_worker_id ON call_session_registry(worker_id);
+CREATE INDEX IF NOT EXISTS idx_call_session_registry_heartbeat_at ON call_session_registry(heartbeat_at);
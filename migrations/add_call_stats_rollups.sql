@@ -0,0 +1,57 @@
+-- 通話統計の時間別集計テーブル
+-- 終了した通話を1時間単位（UTC）に集計しておき、統計APIは集計行と未集計の通話だけを読む
+-- 日別などの粗い単位は、この表を任意のタイムゾーンで束ねて求める
+
+CREATE TABLE IF NOT EXISTS call_stats_hourly (
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL, -- start_time を1時間単位に切り捨てた時刻
+    total_calls INTEGER NOT NULL DEFAULT 0,
+    completed_calls INTEGER NOT NULL DEFAULT 0,
+    failed_calls INTEGER NOT NULL DEFAULT 0,
+    duration_count INTEGER NOT NULL DEFAULT 0, -- end_time のある通話数（平均通話時間の分母）
+    duration_sum DOUBLE PRECISION NOT NULL DEFAULT 0, -- seconds
+    duration_min DOUBLE PRECISION,
+    duration_max DOUBLE PRECISION,
+    PRIMARY KEY (tenant_id, bucket)
+);
+
+-- 集計済みの通話（同じ通話を二重に数えないための印）
+ALTER TABLE call_sessions ADD COLUMN IF NOT EXISTS stats_rolled_up BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- 未集計の通話（通話中・集計待ち）だけを引くための部分インデックス
+CREATE INDEX IF NOT EXISTS idx_call_sessions_not_rolled_up
+    ON call_sessions(tenant_id, start_time)
+    WHERE NOT stats_rolled_up;
+
+-- 既存の終了済み通話を集計（印を付けた行だけを足し込むため、稼働中に実行しても二重に数えない）
+WITH rolled AS (
+    UPDATE call_sessions SET stats_rolled_up = TRUE
+    WHERE NOT stats_rolled_up
+      AND start_time IS NOT NULL
+      AND status NOT IN ('ringing', 'answered', 'in_progress')
+    RETURNING tenant_id, start_time, end_time, status
+)
+INSERT INTO call_stats_hourly (
+    tenant_id, bucket, total_calls, completed_calls, failed_calls,
+    duration_count, duration_sum, duration_min, duration_max
+)
+SELECT
+    tenant_id,
+    date_trunc('hour', start_time, 'UTC'),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE status = 'completed'),
+    COUNT(*) FILTER (WHERE status = 'failed'),
+    COUNT(end_time),
+    COALESCE(SUM(EXTRACT(EPOCH FROM (end_time - start_time))), 0),
+    MIN(EXTRACT(EPOCH FROM (end_time - start_time))),
+    MAX(EXTRACT(EPOCH FROM (end_time - start_time)))
+FROM rolled
+GROUP BY tenant_id, date_trunc('hour', start_time, 'UTC')
+ON CONFLICT (tenant_id, bucket) DO UPDATE SET
+    total_calls = call_stats_hourly.total_calls + EXCLUDED.total_calls,
+    completed_calls = call_stats_hourly.completed_calls + EXCLUDED.completed_calls,
+    failed_calls = call_stats_hourly.failed_calls + EXCLUDED.failed_calls,
+    duration_count = call_stats_hourly.duration_count + EXCLUDED.duration_count,
+    duration_sum = call_stats_hourly.duration_sum + EXCLUDED.duration_sum,
+    duration_min = LEAST(call_stats_hourly.duration_min, EXCLUDED.duration_min),
+    duration_max = GREATEST(call_stats_hourly.duration_max, EXCLUDED.duration_max);
@@ -0,0 +1,4 @@
+-- call_sessionsテーブルにDify会話IDを追加
+-- 同じ通話の後続ターンでDify側の会話コンテキストを引き継ぐために使用
+
+ALTER TABLE call_sessions ADD COLUMN IF NOT EXISTS dify_conversation_id VARCHAR(255);
@@ -0,0 +1,18 @@
+-- 受信FAXの非同期処理（PDF変換・OCR）用の列
+-- Webhookは fax_documents に status = 'queued' の行を作って即座に応答し、
+-- ワーカーが行を取得して処理する（queued → converting → ocr → completed / failed）
+
+ALTER TABLE fax_documents ADD COLUMN IF NOT EXISTS error_message TEXT;
+ALTER TABLE fax_documents ADD COLUMN IF NOT EXISTS pages INTEGER;
+ALTER TABLE fax_documents ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE fax_documents ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE fax_documents ADD COLUMN IF NOT EXISTS locked_at TIMESTAMP WITH TIME ZONE; -- 処理開始時刻（ワーカー停止時の再取得判定）
+
+-- 処理待ち・処理中の行だけを引くための部分インデックス
+CREATE INDEX IF NOT EXISTS idx_fax_documents_queued
+    ON fax_documents(next_attempt_at)
+    WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_fax_documents_processing
+    ON fax_documents(locked_at)
+    WHERE status IN ('converting', 'ocr');
@@ -0,0 +1,17 @@
+-- 一覧APIのカーソル（キーセット）ページング用の複合インデックス
+-- ORDER BY と同じ列順・方向にすることで、深いページでも先頭から読み飛ばさずに取得できる
+
+CREATE INDEX IF NOT EXISTS idx_call_sessions_tenant_start_time
+    ON call_sessions(tenant_id, start_time DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_customers_tenant_created_at
+    ON customers(tenant_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_customer_inquiries_tenant_created_at
+    ON customer_inquiries(tenant_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_articles_tenant_relevance
+    ON knowledge_articles(tenant_id, relevance_score DESC, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_call_campaign_logs_campaign_attempted_at
+    ON call_campaign_logs(campaign_id, attempted_at DESC, id DESC);
@@ -10,6 +10,7 @@ class CallSession(BaseModel):
     start_time: datetime
     end_time: Optional[datetime] = None
     status: str
+    dify_conversation_id: Optional[str] = None
     
 class Message(BaseModel):
     id: str
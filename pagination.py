@@ -0,0 +1,88 @@
+import base64
+import json
+from datetime import datetime
+from typing import Awaitable, Callable, List, Literal, Optional, Sequence
+from uuid import UUID
+from fastapi import HTTPException
+
+# 一覧APIの総件数の取得方法
+#   exact: 正確な件数（オフセット指定時は一覧と同じクエリでCOUNT(*) OVER()により取得）
+#   estimate: プランナの推定件数（EXPLAIN）
+#   none: 件数を取得しない（totalはnull）
+CountMode = Literal["exact", "estimate", "none"]
+
+def encode_cursor(values: Sequence) -> str:
+    """並び順のキー値を不透明なカーソル文字列に変換"""
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            encoded.append({"dt": value.isoformat()})
+        elif isinstance(value, UUID):
+            encoded.append(str(value))
+        else:
+            encoded.append(value)
+    raw = json.dumps(encoded, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """
+    カーソル文字列を並び順のキー値に戻す
+
+    Raises:
+        HTTPException: カーソルが不正な場合（400）
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = []
+        for value in json.loads(raw):
+            if isinstance(value, dict):
+                value = datetime.fromisoformat(value["dt"])
+            values.append(value)
+        return tuple(values)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def next_cursor(rows: List[dict], limit: int, keys: Sequence[str]) -> Optional[str]:
+    """
+    次のページのカーソルを生成（最後のページの場合はNone）
+
+    Args:
+        rows: 取得した行（並び順どおり）
+        limit: 1ページの件数
+        keys: 並び順のキー列名（ORDER BYと同じ順）
+    """
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor([last[key] for key in keys])
+
+def with_total(count: CountMode, cursor: Optional[tuple]) -> bool:
+    """一覧クエリで総件数を同時に取得するかどうか（カーソル指定時は対象外）"""
+    return count == "exact" and not cursor
+
+async def resolve_total(
+    count: CountMode,
+    rows: List[dict],
+    count_rows: Callable[[bool], Awaitable[int]]
+) -> Optional[int]:
+    """
+    一覧の総件数を取得し、行に付いたtotal_count列を取り除く
+
+    Args:
+        count: 件数の取得方法
+        rows: 取得した行（with_totalで取得した場合はtotal_count列付き）
+        count_rows: 件数クエリ（引数はestimate）。行から件数が得られない場合のみ実行する
+    """
+    total = None
+    for row in rows:
+        total = row.pop("total_count", None)
+    if count == "none":
+        return None
+    if count == "estimate":
+        return await count_rows(True)
+    if total is not None:
+        return total
+    # カーソル指定時や、OFFSETが件数を超えて行が返らなかった場合
+    return await count_rows(False)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+from typing import Callable, Optional
+import asyncpg
+from database import Database
+
+# LISTEN接続が切れた場合の再接続までの待ち時間（秒、失敗が続くと倍増して上限まで）
+PG_LISTEN_RETRY_SECONDS = float(os.getenv("PG_LISTEN_RETRY_SECONDS", "1"))
+PG_LISTEN_RETRY_MAX_SECONDS = float(os.getenv("PG_LISTEN_RETRY_MAX_SECONDS", "30"))
+
+# 通知の処理（接続, 送信元pid, チャネル, ペイロード）
+NotifyCallback = Callable[[asyncpg.Connection, int, str, str], None]
+
+class NotifyListener:
+    def __init__(
+        self,
+        database: Database,
+        channel: str,
+        callback: NotifyCallback,
+        on_reconnect: Optional[Callable[[], None]] = None
+    ):
+        """
+        Postgresのチャネルを専用接続でLISTENし続ける
+
+        接続プールの枠を占有しないよう asyncpg.connect() の専用接続を使い、
+        接続が切れたことを検知したら待ち時間を倍増させながら再接続する。
+        切れていた間の通知は届かないため、再接続できたら on_reconnect を呼ぶ
+        （キャッシュの全破棄や一覧の突き合わせで取りこぼしを埋める）。
+
+        Args:
+            database: 接続設定を持つデータベース
+            channel: LISTENするチャネル
+            callback: 通知を受け取る関数
+            on_reconnect: 再接続後に呼ぶ関数
+        """
+        self.database = database
+        self.channel = channel
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connects = 0
+        self.disconnects = 0
+
+    @property
+    def listening(self) -> bool:
+        """LISTEN中の接続があるかどうか"""
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def start(self):
+        """LISTENを開始（接続できるまでバックグラウンドで再試行する）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """LISTENを停止して接続を閉じる"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+
+    async def _run(self):
+        delay = PG_LISTEN_RETRY_SECONDS
+        while True:
+            try:
+                await self._listen()
+                # 一度つながった後に切れた場合はすぐに再接続する
+                delay = PG_LISTEN_RETRY_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: failed to listen on channel {self.channel}: {e}")
+            await self._close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PG_LISTEN_RETRY_MAX_SECONDS)
+
+    async def _listen(self):
+        """接続してLISTENし、接続が切れるまで待つ"""
+        closed = asyncio.Event()
+        self._conn = await self.database.create_connection()
+        self._conn.add_termination_listener(lambda connection: closed.set())
+        await self._conn.add_listener(self.channel, self.callback)
+        if self.connects and self.on_reconnect:
+            self.on_reconnect()
+        self.connects += 1
+
+        await closed.wait()
+        self.disconnects += 1
+        print(f"Warning: LISTEN connection for channel {self.channel} was lost. Reconnecting.")
+
+    async def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is None or conn.is_closed():
+            return
+        try:
+            await conn.close(timeout=5)
+        except Exception:
+            conn.terminate()
+
+    def stats(self) -> dict:
+        return {
+            "listening": self.listening,
+            "connects": self.connects,
+            "disconnects": self.disconnects
+        }
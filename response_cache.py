@@ -0,0 +1,217 @@
+import asyncio
+import importlib.util
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from database import Database, db
+from pg_listener import NotifyListener
+
+# 応答キャッシュの有効期限（秒）とテナントごとの件数上限
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# キャッシュ対象とする質問の最短文字数（正規化後）
+RESPONSE_CACHE_MIN_LENGTH = int(os.getenv("RESPONSE_CACHE_MIN_LENGTH", "4"))
+# 類似質問の判定に使うローカル埋め込みモデル（空なら完全一致のみ）
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+# Postgres LISTEN/NOTIFYで他ワーカーのキャッシュも破棄するかどうか
+RESPONSE_CACHE_NOTIFY = os.getenv("RESPONSE_CACHE_NOTIFY", "false").lower() == "true"
+RESPONSE_CACHE_CHANNEL = "knowledge_changed"
+
+# 正規化で取り除く記号・空白（句読点や言い淀みの差を吸収する）
+_IGNORED = re.compile(r"[\s、。，．,.！!？?・「」『』（）()〜~ー…]+")
+
+# (応答テキスト, 有効期限, 質問の埋め込み)
+_Entry = Tuple[str, float, Optional[np.ndarray]]
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        embedding_model: str = RESPONSE_CACHE_EMBEDDING_MODEL,
+        similarity: float = RESPONSE_CACHE_SIMILARITY
+    ):
+        """
+        テナント単位のDify応答キャッシュを初期化
+
+        営業時間・住所・FAX番号のような定番の質問は、正規化した質問文の
+        完全一致（埋め込みモデルを指定した場合は類似度）でキャッシュから答え、
+        LLMへの問い合わせを省く。ナレッジ記事が変わったテナントの
+        キャッシュは破棄する。
+
+        Args:
+            ttl: 有効期限（秒）
+            max_entries: テナントごとの件数上限（超えたら古い順に削除）
+            embedding_model: sentence-transformersのモデル名（空なら完全一致のみ）
+            similarity: 類似質問とみなすコサイン類似度の下限
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries: Dict[str, "OrderedDict[str, _Entry]"] = {}
+
+        self.embedding_model = embedding_model
+        if embedding_model and importlib.util.find_spec("sentence_transformers") is None:
+            print("Warning: sentence-transformers is not installed. Response cache uses exact matching only.")
+            self.embedding_model = ""
+        self._model = None
+        self._model_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """全角半角・大文字小文字・記号・空白の差を吸収した質問文"""
+        return _IGNORED.sub("", unicodedata.normalize("NFKC", text).lower())
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """質問文の埋め込み（正規化済みベクトル）を計算"""
+        if not self.embedding_model:
+            return None
+        async with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = await asyncio.to_thread(SentenceTransformer, self.embedding_model)
+        vector = await asyncio.to_thread(self._model.encode, text, normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+
+    async def get(self, tenant_id: str, text: str) -> Optional[str]:
+        """
+        質問に対するキャッシュ済みの応答を取得
+
+        Returns:
+            Optional[str]: 応答テキスト（キャッシュになければNone）
+        """
+        entries = self._entries.get(str(tenant_id))
+        key = self.normalize(text)
+        if not entries or len(key) < RESPONSE_CACHE_MIN_LENGTH:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        entry = entries.get(key)
+        if entry and entry[1] > now:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        if self.embedding_model:
+            try:
+                vector = await self._embed(key)
+            except Exception as e:
+                print(f"Warning: failed to embed query for response cache: {e}")
+                vector = None
+            if vector is not None:
+                best_key, best_score = None, self.similarity
+                for cached_key, (_, expires_at, cached_vector) in entries.items():
+                    if expires_at <= now or cached_vector is None:
+                        continue
+                    score = float(np.dot(vector, cached_vector))
+                    if score >= best_score:
+                        best_key, best_score = cached_key, score
+                if best_key is not None:
+                    entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return entries[best_key][0]
+
+        self.misses += 1
+        return None
+
+    async def put(self, tenant_id: str, text: str, response: str):
+        """質問と応答をキャッシュに保存"""
+        key = self.normalize(text)
+        if len(key) < RESPONSE_CACHE_MIN_LENGTH or not response:
+            return
+
+        vector = None
+        if self.embedding_model:
+            try:
+                vector = await self._embed(key)
+            except Exception as e:
+                print(f"Warning: failed to embed query for response cache: {e}")
+
+        entries = self._entries.setdefault(str(tenant_id), OrderedDict())
+        entries[key] = (response, time.monotonic() + self.ttl, vector)
+        entries.move_to_end(key)
+
+        # 期限切れを掃除してから件数上限まで古い順に削除
+        now = time.monotonic()
+        for expired in [k for k, entry in entries.items() if entry[1] <= now]:
+            del entries[expired]
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        """テナントのキャッシュを破棄（ナレッジ記事の変更時。tenant_id省略時は全件）"""
+        if tenant_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(tenant_id), None)
+
+    def stats(self) -> dict:
+        """キャッシュのヒット率と件数"""
+        lookups = self.hits + self.misses
+        return {
+            "tenants": len(self._entries),
+            "entries": sum(len(entries) for entries in self._entries.values()),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+# プロセス共有の応答キャッシュ（ナレッジAPIからも無効化する）
+response_cache = ResponseCache()
+
+async def invalidate_response_cache(tenant_id: str):
+    """
+    ナレッジ記事の変更をテナントの応答キャッシュに反映
+
+    RESPONSE_CACHE_NOTIFY=trueの場合は他ワーカーにもNOTIFYで通知する。
+    """
+    response_cache.invalidate(tenant_id)
+    if RESPONSE_CACHE_NOTIFY and db.pool:
+        try:
+            async with db.pool.acquire() as conn:
+                await conn.execute("SELECT pg_notify($1, $2)", RESPONSE_CACHE_CHANNEL, str(tenant_id))
+        except Exception as e:
+            print(f"Warning: failed to notify response cache invalidation: {e}")
+
+def _on_knowledge_notify(connection, pid, channel, payload):
+    if payload:
+        response_cache.invalidate(payload)
+
+async def start_response_cache_listener(database: Database) -> Optional[NotifyListener]:
+    """
+    他ワーカーからの応答キャッシュ破棄通知の受信を開始（RESPONSE_CACHE_NOTIFY=true時）
+
+    専用接続でLISTENし、接続が切れていた間の通知を取りこぼした可能性があるため
+    再接続時はキャッシュを全件破棄する。
+
+    Returns:
+        Optional[NotifyListener]: 受信中のリスナー（停止時にclose_response_cache_listenerへ渡す）
+    """
+    if not RESPONSE_CACHE_NOTIFY:
+        return None
+
+    listener = NotifyListener(
+        database,
+        RESPONSE_CACHE_CHANNEL,
+        _on_knowledge_notify,
+        on_reconnect=response_cache.invalidate
+    )
+    await listener.start()
+    return listener
+
+async def close_response_cache_listener(listener: Optional[NotifyListener]):
+    """応答キャッシュ破棄通知の受信を停止"""
+    if listener is not None:
+        await listener.stop()
@@ -0,0 +1,256 @@
+import asyncio
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+from database import Database
+
+# 通話セッションの所在を共有する方式（memory: プロセス内 / postgres: 全ワーカーで共有）
+SESSION_REGISTRY = os.getenv("SESSION_REGISTRY", "memory")
+# 生存通知の間隔と、通知が途絶えたセッションを無効とみなすまでの時間（秒）
+SESSION_HEARTBEAT_SECONDS = float(os.getenv("SESSION_HEARTBEAT_SECONDS", "10"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "30"))
+# このワーカーの識別子（省略時はホスト名とプロセスID）
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+class SessionRegistry(ABC):
+    """
+    WebSocket接続中の通話セッションがどのワーカーにあるかを記録する
+
+    音声エンジンやWebSocketなどの実体は接続を受けたワーカーの
+    active_sessions に置き、ここには所在（通話ID・テナント・ワーカー）だけを載せる。
+    """
+
+    # 他のワーカーと共有されるかどうか（制御イベントの転送要否）
+    shared = False
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+
+    async def start(self):
+        """生存通知などのバックグラウンド処理を開始"""
+
+    async def stop(self):
+        """バックグラウンド処理を停止し、このワーカーのセッションを削除"""
+
+    @abstractmethod
+    async def register(self, call_id: str, tenant_id: str):
+        """このワーカーで接続した通話を登録"""
+
+    @abstractmethod
+    async def unregister(self, call_id: str):
+        """このワーカーの通話の登録を削除"""
+
+    @abstractmethod
+    async def get(self, call_id: str) -> Optional[dict]:
+        """通話の所在（call_id, tenant_id, worker_id, connected_at, heartbeat_at）を取得"""
+
+    @abstractmethod
+    async def list(self, tenant_id: Optional[str] = None) -> List[dict]:
+        """接続中の通話一覧（tenant_id省略時は全テナント）"""
+
+    def is_local(self, session: Optional[dict]) -> bool:
+        """このワーカーのセッションかどうか"""
+        return bool(session) and session["worker_id"] == self.worker_id
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """状態（/health用）"""
+
+class InProcessSessionRegistry(SessionRegistry):
+    """プロセス内の辞書に記録する（ワーカーが1つの場合の既定）"""
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        super().__init__(worker_id)
+        self._sessions: Dict[str, dict] = {}
+
+    async def register(self, call_id: str, tenant_id: str):
+        now = datetime.utcnow()
+        self._sessions[str(call_id)] = {
+            "call_id": str(call_id),
+            "tenant_id": str(tenant_id),
+            "worker_id": self.worker_id,
+            "connected_at": now,
+            "heartbeat_at": now
+        }
+
+    async def unregister(self, call_id: str):
+        self._sessions.pop(str(call_id), None)
+
+    async def get(self, call_id: str) -> Optional[dict]:
+        return self._sessions.get(str(call_id))
+
+    async def list(self, tenant_id: Optional[str] = None) -> List[dict]:
+        return [
+            session for session in self._sessions.values()
+            if tenant_id is None or session["tenant_id"] == str(tenant_id)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "worker_id": self.worker_id,
+            "local_sessions": len(self._sessions)
+        }
+
+class PostgresSessionRegistry(SessionRegistry):
+    """
+    Postgresの call_session_registry テーブルに記録し、全ワーカー・全ノードで共有する
+
+    各ワーカーは自分のセッションの heartbeat_at を定期的に更新する。
+    更新が SESSION_TTL_SECONDS 途絶えた行（落ちたワーカーの通話）は無効とみなし、
+    次の生存通知のついでに削除する。
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        database: Database,
+        worker_id: str = WORKER_ID,
+        heartbeat_seconds: float = SESSION_HEARTBEAT_SECONDS,
+        ttl_seconds: float = SESSION_TTL_SECONDS
+    ):
+        super().__init__(worker_id)
+        self.database = database
+        self.heartbeat_seconds = heartbeat_seconds
+        self.ttl_seconds = ttl_seconds
+        # このワーカーの通話（call_id → tenant_id）。生存通知で再登録にも使う
+        self._local: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.heartbeats = 0
+        self.heartbeat_failures = 0
+        self.last_heartbeat: Optional[float] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            async with self.database.pool.acquire() as conn:
+                await conn.execute("DELETE FROM call_session_registry WHERE worker_id = $1", self.worker_id)
+        except Exception as e:
+            print(f"Warning: failed to clear session registry: {e}")
+        self._local.clear()
+
+    async def register(self, call_id: str, tenant_id: str):
+        self._local[str(call_id)] = str(tenant_id)
+        async with self.database.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO call_session_registry (call_id, tenant_id, worker_id, connected_at, heartbeat_at)
+                VALUES ($1, $2, $3, now(), now())
+                ON CONFLICT (call_id) DO UPDATE SET
+                    tenant_id = EXCLUDED.tenant_id,
+                    worker_id = EXCLUDED.worker_id,
+                    connected_at = EXCLUDED.connected_at,
+                    heartbeat_at = EXCLUDED.heartbeat_at
+                """,
+                call_id, tenant_id, self.worker_id
+            )
+
+    async def unregister(self, call_id: str):
+        self._local.pop(str(call_id), None)
+        async with self.database.pool.acquire() as conn:
+            # 別のワーカーに再接続済みの場合はその登録を残す
+            await conn.execute(
+                "DELETE FROM call_session_registry WHERE call_id = $1 AND worker_id = $2",
+                call_id, self.worker_id
+            )
+
+    async def get(self, call_id: str) -> Optional[dict]:
+        async with self.database.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT * FROM call_session_registry
+                WHERE call_id = $1 AND heartbeat_at > now() - make_interval(secs => $2)
+                """,
+                call_id, self.ttl_seconds
+            )
+            return self._to_dict(row) if row else None
+
+    async def list(self, tenant_id: Optional[str] = None) -> List[dict]:
+        async with self.database.pool.acquire() as conn:
+            if tenant_id is None:
+                rows = await conn.fetch(
+                    """
+                    SELECT * FROM call_session_registry
+                    WHERE heartbeat_at > now() - make_interval(secs => $1)
+                    """,
+                    self.ttl_seconds
+                )
+            else:
+                rows = await conn.fetch(
+                    """
+                    SELECT * FROM call_session_registry
+                    WHERE tenant_id = $1 AND heartbeat_at > now() - make_interval(secs => $2)
+                    """,
+                    tenant_id, self.ttl_seconds
+                )
+            return [self._to_dict(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        session = dict(row)
+        session["call_id"] = str(session["call_id"])
+        session["tenant_id"] = str(session["tenant_id"])
+        return session
+
+    async def _heartbeat(self):
+        call_ids = list(self._local)
+        async with self.database.pool.acquire() as conn:
+            if call_ids:
+                # 他のワーカーに期限切れとして削除されていても再登録する
+                await conn.execute(
+                    """
+                    INSERT INTO call_session_registry (call_id, tenant_id, worker_id, connected_at, heartbeat_at)
+                    SELECT call_id, tenant_id, $3, now(), now()
+                    FROM unnest($1::uuid[], $2::uuid[]) AS s(call_id, tenant_id)
+                    ON CONFLICT (call_id) DO UPDATE SET heartbeat_at = now()
+                    WHERE call_session_registry.worker_id = EXCLUDED.worker_id
+                    """,
+                    call_ids, [self._local[call_id] for call_id in call_ids], self.worker_id
+                )
+            await conn.execute(
+                "DELETE FROM call_session_registry WHERE heartbeat_at < now() - make_interval(secs => $1)",
+                self.ttl_seconds
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self._heartbeat()
+                self.heartbeats += 1
+                self.last_heartbeat = time.monotonic()
+            except Exception as e:
+                self.heartbeat_failures += 1
+                print(f"Warning: session registry heartbeat failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "postgres",
+            "worker_id": self.worker_id,
+            "local_sessions": len(self._local),
+            "heartbeats": self.heartbeats,
+            "heartbeat_failures": self.heartbeat_failures,
+            "heartbeat_age": time.monotonic() - self.last_heartbeat if self.last_heartbeat else None
+        }
+
+def create_session_registry(database: Database, backend: str = SESSION_REGISTRY) -> SessionRegistry:
+    """設定に応じたセッションレジストリを生成"""
+    if backend == "postgres":
+        return PostgresSessionRegistry(database)
+    if backend != "memory":
+        print(f"Warning: unknown SESSION_REGISTRY '{backend}'. Using in-process registry.")
+    return InProcessSessionRegistry()
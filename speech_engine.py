@@ -0,0 +1,379 @@
+import asyncio
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape
+import azure.cognitiveservices.speech as speechsdk
+from speech_stream import StreamingRecognizer
+from tts_cache import TTSCache
+
+# テナントごとに待機させておく接続済みSynthesizerの数
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))
+
+# 通話音声のサンプリングレート（16-bit mono PCM）
+SAMPLE_RATE = 8000
+
+# 合成音声を生成途中から固定長フレームで送信するかどうか
+TTS_STREAMING = os.getenv("TTS_STREAMING", "true").lower() == "true"
+# 送信フレームの長さ（ミリ秒）
+TTS_FRAME_MS = int(os.getenv("TTS_FRAME_MS", "20"))
+# 再生位置より先行して送ってよい長さ（ミリ秒）
+TTS_PACING_LEAD_MS = int(os.getenv("TTS_PACING_LEAD_MS", "200"))
+# 合成器から1回に読み出すサイズ（200ms分）
+TTS_READ_SIZE = SAMPLE_RATE * 2 // 5
+# 合成音声の出力形式（キャッシュキーに含める）
+TTS_AUDIO_FORMAT = "raw-8khz-16bit-mono-pcm" if TTS_STREAMING else "riff-16khz-16bit-mono-pcm"
+
+DEFAULT_LANGUAGE = "ja-JP"
+DEFAULT_VOICE = "ja-JP-NanamiNeural"
+
+# (subscription, region, language, voice)
+ConfigKey = Tuple[str, str, str, str]
+
+class FramePacer:
+    def __init__(self, frame_ms: int = TTS_FRAME_MS, lead_ms: int = TTS_PACING_LEAD_MS):
+        """
+        音声フレームの送信を再生速度に合わせる
+
+        相手側の再生位置よりlead_ms以上先行しないよう送信を待たせ、
+        Asterisk側のバッファを溢れさせない。合成が再生に追いつかなかった
+        場合は、その時点を起点に数え直す。
+
+        Args:
+            frame_ms: 1フレームの長さ（ミリ秒）
+            lead_ms: 先行して送ってよい長さ（ミリ秒）
+        """
+        self.frame = frame_ms / 1000.0
+        self.lead = lead_ms / 1000.0
+        self._end = 0.0
+
+    async def wait(self):
+        """次のフレームを送ってよい時刻まで待つ"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # 送信済みの音声を相手が再生し終える時刻
+        self._end = max(self._end, now)
+        ahead = self._end - now
+        if ahead > self.lead:
+            await asyncio.sleep(ahead - self.lead)
+        self._end += self.frame
+
+class SynthesizerPool:
+    def __init__(self, size: int = TTS_POOL_SIZE):
+        """
+        テナント単位の接続済みSpeechSynthesizerウォームプールを初期化
+
+        SpeechConfigもキー単位で1つだけ生成して使い回す。
+        Synthesizerは事前にConnectionをopenしておき、
+        発話ごとのTCP/TLS接続・認証のコストを払わないようにする。
+
+        Args:
+            size: キーごとに待機させるSynthesizerの数
+        """
+        self.size = size
+        self._configs: Dict[ConfigKey, speechsdk.SpeechConfig] = {}
+        self._idle: Dict[ConfigKey, List[speechsdk.SpeechSynthesizer]] = {}
+        self._connections: Dict[int, speechsdk.Connection] = {}
+        self._warming: Dict[ConfigKey, asyncio.Task] = {}
+
+    def get_speech_config(
+        self,
+        subscription: str,
+        region: str,
+        language: str = DEFAULT_LANGUAGE,
+        voice: str = DEFAULT_VOICE
+    ) -> Tuple[ConfigKey, speechsdk.SpeechConfig]:
+        """キーに対応するSpeechConfigを取得（なければ生成）"""
+        key = (subscription, region, language, voice)
+        config = self._configs.get(key)
+        if config is None:
+            config = speechsdk.SpeechConfig(subscription=subscription, region=region)
+            config.speech_recognition_language = language
+            config.speech_synthesis_language = language
+            config.speech_synthesis_voice_name = voice
+            if TTS_STREAMING:
+                # フレーム単位で送るため、WAVヘッダなしの通話音声と同じ形式で受け取る
+                config.set_speech_synthesis_output_format(
+                    speechsdk.SpeechSynthesisOutputFormat.Raw8Khz16BitMonoPcm
+                )
+            self._configs[key] = config
+        return key, config
+
+    def _create_synthesizer(self, key: ConfigKey) -> speechsdk.SpeechSynthesizer:
+        """接続済みのSynthesizerを生成（ブロッキング）"""
+        # audio_config=None: スピーカーへ出力せず、結果の音声データだけを受け取る
+        synthesizer = speechsdk.SpeechSynthesizer(
+            speech_config=self._configs[key],
+            audio_config=None
+        )
+        connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+        connection.open(True)
+        self._connections[id(synthesizer)] = connection
+        return synthesizer
+
+    async def warm(self, key: ConfigKey):
+        """待機中のSynthesizerをプールサイズまで補充"""
+        idle = self._idle.setdefault(key, [])
+        while len(idle) < self.size:
+            try:
+                synthesizer = await asyncio.to_thread(self._create_synthesizer, key)
+            except Exception as e:
+                print(f"Warning: failed to pre-connect synthesizer: {e}")
+                return
+            idle.append(synthesizer)
+
+    def _schedule_warm(self, key: ConfigKey):
+        task = self._warming.get(key)
+        if task is None or task.done():
+            self._warming[key] = asyncio.create_task(self.warm(key))
+
+    async def acquire(self, key: ConfigKey) -> speechsdk.SpeechSynthesizer:
+        """Synthesizerを借りる（待機中がなければその場で生成）"""
+        idle = self._idle.setdefault(key, [])
+        if idle:
+            synthesizer = idle.pop()
+        else:
+            synthesizer = await asyncio.to_thread(self._create_synthesizer, key)
+        self._schedule_warm(key)
+        return synthesizer
+
+    def release(self, key: ConfigKey, synthesizer: speechsdk.SpeechSynthesizer):
+        """Synthesizerをプールに返却（満杯なら破棄）"""
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.size:
+            idle.append(synthesizer)
+        else:
+            self._discard(synthesizer)
+
+    def _discard(self, synthesizer: speechsdk.SpeechSynthesizer):
+        connection = self._connections.pop(id(synthesizer), None)
+        if connection:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        """すべての待機中Synthesizerを破棄"""
+        for task in self._warming.values():
+            task.cancel()
+        self._warming.clear()
+        for idle in self._idle.values():
+            for synthesizer in idle:
+                self._discard(synthesizer)
+        self._idle.clear()
+
+class SpeechEngine:
+    def __init__(
+        self,
+        pool: SynthesizerPool,
+        subscription: str,
+        region: str,
+        language: str = DEFAULT_LANGUAGE,
+        voice: str = DEFAULT_VOICE,
+        rate: float = 1.0,
+        volume: Optional[int] = None,
+        cache: Optional[TTSCache] = None
+    ):
+        """
+        通話単位の音声エンジンを初期化
+
+        SpeechConfig・認識器・合成器を通話の開始時に一度だけ用意し、
+        通話中の各ターンで使い回す。
+
+        Args:
+            pool: Synthesizerウォームプール
+            subscription: Azure Speechサブスクリプションキー
+            region: Azure Speechリージョン
+            language: 認識・合成の言語
+            voice: 合成音声名
+            rate: 話速（1.0が標準）
+            volume: 音量（0〜100、Noneの場合は標準）
+            cache: 定型文の合成音声キャッシュ
+        """
+        self.pool = pool
+        self.key, self.speech_config = pool.get_speech_config(subscription, region, language, voice)
+        self.language = language
+        self.voice = voice
+        self.rate = rate
+        self.volume = volume
+        self.cache = cache
+        self.recognizer: Optional[StreamingRecognizer] = None
+        self._synthesizer: Optional[speechsdk.SpeechSynthesizer] = None
+
+    async def start(self, streaming: bool = True):
+        """
+        通話開始時の準備
+
+        Args:
+            streaming: Trueの場合は連続認識の認識器を起動する
+        """
+        if streaming:
+            self.recognizer = StreamingRecognizer(self.speech_config, sample_rate=SAMPLE_RATE)
+            await self.recognizer.start()
+        self._synthesizer = await self.pool.acquire(self.key)
+
+    async def recognize(self, audio_data: Union[bytes, memoryview]) -> str:
+        """発話全体の音声データを一括で認識（STT_MODE=once用）"""
+        audio_input = speechsdk.audio.PushAudioInputStream(
+            stream_format=speechsdk.audio.AudioStreamFormat(
+                samples_per_second=SAMPLE_RATE,
+                bits_per_sample=16,
+                channels=1
+            )
+        )
+        # SDKへはbytesで渡す（発話バッファからのコピーはここでの1回のみ）
+        audio_input.write(bytes(audio_data))
+        audio_input.close()
+        speech_recognizer = speechsdk.SpeechRecognizer(
+            speech_config=self.speech_config,
+            audio_config=speechsdk.audio.AudioConfig(stream=audio_input)
+        )
+
+        result = await asyncio.to_thread(speech_recognizer.recognize_once_async().get)
+        if result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            return result.text
+        return ""
+
+    def _ssml(self, text: str) -> Optional[str]:
+        """話速・音量の指定がある場合のSSML（なければNone）"""
+        prosody = []
+        if self.rate != 1.0:
+            prosody.append(f'rate="{self.rate:g}"')
+        if self.volume is not None:
+            prosody.append(f'volume="{self.volume}"')
+        if not prosody:
+            return None
+        return (
+            f'<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="{self.language}">'
+            f'<voice name="{self.voice}"><prosody {" ".join(prosody)}>{escape(text)}</prosody></voice>'
+            f'</speak>'
+        )
+
+    def _cache_key(self, text: str) -> str:
+        return TTSCache.make_key(self.voice, self.rate, self.volume, TTS_AUDIO_FORMAT, text)
+
+    async def synthesize(self, text: str, cache: bool = False) -> bytes:
+        """
+        Azure Text-to-Speechで音声合成を実行
+
+        Args:
+            text: 合成するテキスト
+            cache: 定型文としてキャッシュを参照・保存するかどうか
+        """
+        key = self._cache_key(text) if cache and self.cache else None
+        if key:
+            audio = await self.cache.get(key)
+            if audio:
+                return audio
+
+        if self._synthesizer is None:
+            self._synthesizer = await self.pool.acquire(self.key)
+
+        synthesizer = self._synthesizer
+        ssml = self._ssml(text)
+        try:
+            speak = synthesizer.speak_ssml_async(ssml) if ssml else synthesizer.speak_text_async(text)
+            result = await asyncio.to_thread(speak.get)
+        except asyncio.CancelledError:
+            # 待機を取り消しても合成は続くため、明示的に止めて合成器を空ける
+            synthesizer.stop_speaking_async()
+            raise
+        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+            if key:
+                await self.cache.put(key, result.audio_data)
+            return result.audio_data
+        return b""
+
+    async def prewarm(self, phrases: List[str]):
+        """定型文のうちキャッシュにないものを事前に合成する"""
+        if not self.cache:
+            return
+        for phrase in phrases:
+            if not self.cache.contains(self._cache_key(phrase)):
+                await self.synthesize(phrase, cache=True)
+
+    async def synthesize_stream(
+        self,
+        text: str,
+        frame_ms: int = TTS_FRAME_MS,
+        cache: bool = False
+    ) -> AsyncIterator[bytes]:
+        """
+        音声合成を開始し、生成された音声を固定長のPCMフレームで順次返す
+
+        合成の完了を待たずに最初のフレームを返すため、再生開始までの時間と
+        応答1回あたりのメモリが小さくなる（TTS_STREAMING=true用）。
+
+        Args:
+            text: 合成するテキスト
+            frame_ms: フレームの長さ（ミリ秒）
+            cache: 定型文としてキャッシュを参照・保存するかどうか
+
+        Yields:
+            bytes: 16-bit PCMフレーム（最後のフレームは無音で埋める）
+        """
+        frame_size = SAMPLE_RATE * 2 * frame_ms // 1000
+
+        key = self._cache_key(text) if cache and self.cache else None
+        if key:
+            audio = await self.cache.get(key)
+            if audio:
+                for offset in range(0, len(audio), frame_size):
+                    frame = audio[offset:offset + frame_size]
+                    yield frame + bytes(frame_size - len(frame))
+                return
+
+        if self._synthesizer is None:
+            self._synthesizer = await self.pool.acquire(self.key)
+
+        synthesizer = self._synthesizer
+        ssml = self._ssml(text)
+        chunks: List[bytes] = []
+        completed = False
+        try:
+            # 音声の生成が始まった時点で結果が返る
+            speak = (
+                synthesizer.start_speaking_ssml_async(ssml) if ssml
+                else synthesizer.start_speaking_text_async(text)
+            )
+            result = await asyncio.to_thread(speak.get)
+            if result.reason != speechsdk.ResultReason.SynthesizingAudioStarted:
+                completed = True
+                return
+
+            stream = speechsdk.AudioDataStream(result)
+            buffer = bytes(TTS_READ_SIZE)
+            pending = bytearray()
+            while True:
+                filled = await asyncio.to_thread(stream.read_data, buffer)
+                if filled == 0:
+                    break
+                if key:
+                    chunks.append(buffer[:filled])
+                pending += buffer[:filled]
+                offset = 0
+                while len(pending) - offset >= frame_size:
+                    yield bytes(pending[offset:offset + frame_size])
+                    offset += frame_size
+                del pending[:offset]
+
+            if pending:
+                yield bytes(pending) + bytes(frame_size - len(pending))
+            if stream.status == speechsdk.StreamStatus.Canceled:
+                print(f"Warning: speech synthesis canceled: {stream.cancellation_details.error_details}")
+            elif key:
+                await self.cache.put(key, b"".join(chunks))
+            completed = True
+        finally:
+            if not completed:
+                # 途中で打ち切られた場合は合成を止めて合成器を空ける
+                synthesizer.stop_speaking_async()
+
+    async def close(self):
+        """認識器を停止し、Synthesizerをプールへ返却"""
+        if self.recognizer:
+            await self.recognizer.stop()
+            self.recognizer = None
+        if self._synthesizer:
+            self.pool.release(self.key, self._synthesizer)
+            self._synthesizer = None
@@ -0,0 +1,118 @@
+import asyncio
+from typing import Callable, List, Optional
+import azure.cognitiveservices.speech as speechsdk
+
+class StreamingRecognizer:
+    def __init__(
+        self,
+        speech_config: speechsdk.SpeechConfig,
+        sample_rate: int = 8000,
+        on_partial: Optional[Callable[[str], None]] = None
+    ):
+        """
+        通話単位のストリーミング音声認識を初期化
+
+        受信した音声フレームをそのままPushAudioInputStreamへ書き込み、
+        連続認識の途中結果・確定結果をイベントで受け取る。
+        必ずイベントループ上で生成すること（SDKスレッドからの通知に使用）。
+
+        Args:
+            speech_config: Azure Speech設定
+            sample_rate: 入力音声のサンプリングレート (16-bit mono PCM)
+            on_partial: 途中結果を受け取るコールバック
+        """
+        self._loop = asyncio.get_running_loop()
+        self.on_partial = on_partial
+        self.partial_text = ""
+        self._finals: List[str] = []
+        self._final_event = asyncio.Event()
+        self._started = False
+
+        stream_format = speechsdk.audio.AudioStreamFormat(
+            samples_per_second=sample_rate,
+            bits_per_sample=16,
+            channels=1
+        )
+        self.push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+        self.recognizer = speechsdk.SpeechRecognizer(
+            speech_config=speech_config,
+            audio_config=speechsdk.audio.AudioConfig(stream=self.push_stream)
+        )
+
+        # SDKのコールバックは別スレッドで呼ばれるため、イベントループへ転送する
+        self.recognizer.recognizing.connect(
+            lambda evt: self._loop.call_soon_threadsafe(self._handle_recognizing, evt.result.text)
+        )
+        self.recognizer.recognized.connect(
+            lambda evt: self._loop.call_soon_threadsafe(self._handle_recognized, evt.result)
+        )
+        self.recognizer.canceled.connect(
+            lambda evt: self._loop.call_soon_threadsafe(self._handle_canceled, evt)
+        )
+
+    async def start(self):
+        """連続認識を開始"""
+        if self._started:
+            return
+        await asyncio.to_thread(self.recognizer.start_continuous_recognition_async().get)
+        self._started = True
+
+    async def stop(self):
+        """連続認識を停止してストリームを閉じる"""
+        self.push_stream.close()
+        if self._started:
+            self._started = False
+            try:
+                await asyncio.to_thread(self.recognizer.stop_continuous_recognition_async().get)
+            except Exception as e:
+                print(f"Warning: failed to stop recognizer: {e}")
+
+    def write(self, audio_data: bytes):
+        """音声フレームをプッシュストリームに書き込む"""
+        self.push_stream.write(audio_data)
+
+    async def collect_utterance(self, timeout: float = 1.5) -> str:
+        """
+        発話終了後に確定した認識結果を取得
+
+        確定結果が届き、かつ認識途中のテキストが残っていない状態になるまで待つ。
+        タイムアウトした場合は、確定済みの結果（なければ途中結果）を返す。
+
+        Args:
+            timeout: 確定結果を待つ最大秒数
+
+        Returns:
+            str: 認識テキスト
+        """
+        deadline = self._loop.time() + timeout
+        while self.partial_text or not self._finals:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            self._final_event.clear()
+            try:
+                await asyncio.wait_for(self._final_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        text = "".join(self._finals) or self.partial_text
+        self._finals = []
+        self.partial_text = ""
+        return text
+
+    def _handle_recognizing(self, text: str):
+        self.partial_text = text
+        if self.on_partial:
+            self.on_partial(text)
+
+    def _handle_recognized(self, result: speechsdk.SpeechRecognitionResult):
+        self.partial_text = ""
+        if result.reason == speechsdk.ResultReason.RecognizedSpeech and result.text:
+            self._finals.append(result.text)
+        self._final_event.set()
+
+    def _handle_canceled(self, evt: speechsdk.SpeechRecognitionCanceledEventArgs):
+        if evt.reason == speechsdk.CancellationReason.Error:
+            print(f"Speech recognition canceled: {evt.error_details}")
+        self.partial_text = ""
+        self._final_event.set()
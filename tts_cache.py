@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+from dify_client import ERROR_MESSAGE, split_sentences
+
+# 合成音声キャッシュの保存先とサイズ上限
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "storage/tts_cache")
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "64"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "1024"))
+
+def tenant_phrases(settings: dict) -> List[str]:
+    """
+    テナントの定型文（挨拶・担当者呼び出し・引き継ぎ・エラー応答）を文単位で列挙
+
+    応答は文単位で合成されるため、事前合成も同じ区切りで行う。
+    """
+    phrases: List[str] = []
+    for key in ("greeting_message", "human_callout_message", "human_handover_message"):
+        if settings.get(key):
+            phrases.extend(split_sentences(settings[key]))
+    phrases.extend(split_sentences(ERROR_MESSAGE))
+    return list(dict.fromkeys(phrases))
+
+class TTSCache:
+    def __init__(
+        self,
+        directory: str = TTS_CACHE_DIR,
+        memory_mb: int = TTS_CACHE_MEMORY_MB,
+        disk_mb: int = TTS_CACHE_DISK_MB
+    ):
+        """
+        合成音声のコンテンツアドレスキャッシュを初期化
+
+        (音声名, 話速, 音量, 出力形式, テキスト) のハッシュをキーとし、
+        メモリ上のLRUとディスクの2段で保持する。
+        ディスク上のファイルはプロセス・再起動をまたいで共有される。
+
+        Args:
+            directory: ディスクキャッシュの保存先
+            memory_mb: メモリキャッシュの上限（MB）
+            disk_mb: ディスクキャッシュの上限（MB）
+        """
+        self.directory = Path(directory)
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.disk_limit = disk_mb * 1024 * 1024
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        voice: str,
+        rate: float,
+        volume: Optional[int],
+        audio_format: str,
+        text: str
+    ) -> str:
+        """キャッシュキー（SHA-256）を生成"""
+        source = "\0".join([voice, f"{rate:g}", str(volume), audio_format, text])
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.bin"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """キャッシュから音声を取得（メモリ → ディスクの順）"""
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return audio
+
+        path = self._path(key)
+        if path.exists():
+            try:
+                audio = await asyncio.to_thread(path.read_bytes)
+            except OSError as e:
+                print(f"Warning: failed to read TTS cache: {e}")
+            else:
+                self._remember(key, audio)
+                self.hits += 1
+                return audio
+
+        self.misses += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """キャッシュ済みかどうか（事前合成の要否判定用）"""
+        return key in self._memory or self._path(key).exists()
+
+    async def put(self, key: str, audio: bytes):
+        """音声をメモリとディスクに保存"""
+        if not audio:
+            return
+        self._remember(key, audio)
+        try:
+            await asyncio.to_thread(self._write, self._path(key), audio)
+        except OSError as e:
+            print(f"Warning: failed to write TTS cache: {e}")
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.memory_limit:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    @staticmethod
+    def _write(path: Path, audio: bytes):
+        # 書き込み途中のファイルを他のワーカーが読まないよう置き換えで保存
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_suffix(f".{os.getpid()}.tmp")
+        temp.write_bytes(audio)
+        os.replace(temp, path)
+
+    async def prune(self):
+        """ディスクキャッシュを上限まで古い順に削除"""
+        await asyncio.to_thread(self._prune)
+
+    def _prune(self):
+        if not self.directory.exists():
+            return
+        files = [(path.stat(), path) for path in self.directory.glob("*/*.bin")]
+        total = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            if total <= self.disk_limit:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= stat.st_size
+
+    def stats(self) -> dict:
+        """キャッシュのヒット率とメモリ使用量"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
@@ -1,36 +1,354 @@
+import importlib.util
 import numpy as np
-import torch
-import torchaudio
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
 
-class VoiceActivityDetector:
-    def __init__(self):
-        """Silero VADモデルを初期化"""
-        self.model, _ = torch.hub.load(
-            repo_or_dir='snakers4/silero-vad',
-            model='silero_vad',
-            force_reload=False
+# 8kHz時のSilero VAD入力仕様
+SAMPLE_RATE = 8000
+WINDOW_SIZE = 256   # 1回の推論に渡すサンプル数
+CONTEXT_SIZE = 32   # 直前の窓から引き継ぐサンプル数
+STATE_SIZE = 128    # 再帰状態の次元
+
+# 推論バックエンド（onnx: ONNX Runtime / torch: PyTorch JIT）
+VAD_BACKEND = os.getenv("VAD_BACKEND", "onnx")
+# ONNXモデルファイル（未指定ならリポジトリ同梱のmodels/silero_vad.onnx、なければsilero-vadパッケージ同梱のもの）
+VAD_MODEL_PATH = os.getenv("VAD_MODEL_PATH", "")
+# 推論1回あたりのintra-opスレッド数
+VAD_TORCH_THREADS = int(os.getenv("VAD_TORCH_THREADS", "1"))
+
+# 発話判定の平滑化パラメータ
+VAD_THRESHOLD = float(os.getenv("VAD_THRESHOLD", "0.5"))
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "96"))
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+
+# ニューラル推論前のエネルギーゲート
+VAD_GATE_ENABLED = os.getenv("VAD_GATE_ENABLED", "true").lower() == "true"
+VAD_GATE_MARGIN = float(os.getenv("VAD_GATE_MARGIN", "2.0"))
+
+def _resolve_onnx_model_path() -> str:
+    """ローカルディスク上のSilero VAD ONNXモデルのパスを決定"""
+    if VAD_MODEL_PATH:
+        return VAD_MODEL_PATH
+
+    bundled = Path(__file__).parent / "models" / "silero_vad.onnx"
+    if bundled.exists():
+        return str(bundled)
+
+    # パッケージをimportするとtorchが読み込まれるため、場所だけを調べる
+    spec = importlib.util.find_spec("silero_vad")
+    if spec is None or not spec.submodule_search_locations:
+        raise RuntimeError("Silero VAD ONNX model not found. Set VAD_MODEL_PATH or install silero-vad.")
+    return str(Path(spec.submodule_search_locations[0]) / "data" / "silero_vad.onnx")
+
+class OnnxSileroBackend:
+    """ONNX Runtimeによる推論（状態を入出力で明示的に受け渡す）"""
+
+    # 同じセッションを複数スレッドから同時に呼び出せる
+    thread_safe = True
+
+    def __init__(self, model_path: str, num_threads: int = 1):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self._sr = np.array(SAMPLE_RATE, dtype=np.int64)
+
+    def infer(
+        self,
+        windows: np.ndarray,
+        contexts: np.ndarray,
+        states: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        x = np.concatenate([contexts, windows], axis=1)
+        probs, new_states = self.session.run(
+            None,
+            {"input": x, "state": states, "sr": self._sr}
         )
+        return probs.reshape(windows.shape[0]), x[:, -CONTEXT_SIZE:].copy(), new_states
+
+class TorchSileroBackend:
+    """PyTorch JITモデルによる推論（モデル内部の状態属性を入れ替えて使う）"""
+
+    # モデルの状態属性を入れ替えるため、同時に推論できるのは1スレッドのみ
+    thread_safe = False
+
+    def __init__(self, num_threads: int = 1):
+        import torch
+        from silero_vad import load_silero_vad
+
+        torch.set_num_threads(num_threads)
+        self.torch = torch
+        self.model = load_silero_vad(onnx=False)
         self.model.eval()
-        
-    def detect(self, audio_data: bytes, threshold: float = 0.5) -> bool:
+
+    def infer(
+        self,
+        windows: np.ndarray,
+        contexts: np.ndarray,
+        states: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        torch = self.torch
+        batch_size = windows.shape[0]
+        with torch.no_grad():
+            self.model._state = torch.from_numpy(states)
+            self.model._context = torch.from_numpy(contexts)
+            self.model._last_sr = SAMPLE_RATE
+            self.model._last_batch_size = batch_size
+
+            probs = self.model(torch.from_numpy(windows), SAMPLE_RATE)
+
+            new_states = self.model._state.numpy().copy()
+            new_contexts = self.model._context.numpy().copy()
+        return probs.numpy().reshape(batch_size), new_contexts, new_states
+
+class VoiceActivityDetector:
+    def __init__(self, backend: str = VAD_BACKEND, num_threads: int = VAD_TORCH_THREADS):
+        """
+        Silero VADモデルを初期化
+
+        Args:
+            backend: 推論バックエンド ("onnx" または "torch")
+            num_threads: 推論1回あたりのintra-opスレッド数
+        """
+        if backend == "torch":
+            self.backend = TorchSileroBackend(num_threads)
+        elif backend == "onnx":
+            self.backend = OnnxSileroBackend(_resolve_onnx_model_path(), num_threads)
+        else:
+            raise ValueError(f"Unknown VAD backend: {backend}")
+        self._lock = threading.Lock()
+        print(f"VAD backend: {backend}")
+
+    @staticmethod
+    def initial_state() -> Tuple[np.ndarray, np.ndarray]:
+        """ストリーム1本分の初期状態 (context, state) を生成"""
+        context = np.zeros(CONTEXT_SIZE, dtype=np.float32)
+        state = np.zeros((2, STATE_SIZE), dtype=np.float32)
+        return context, state
+
+    def infer_batch(
+        self,
+        windows: np.ndarray,
+        contexts: np.ndarray,
+        states: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        複数ストリームの窓をまとめて1回で推論
+
+        各ストリームの状態を明示的に渡し、推論後の状態を返す。
+        ワーカースレッドから呼ばれることを想定している。
+
+        Args:
+            windows: (B, WINDOW_SIZE) float32 音声窓
+            contexts: (B, CONTEXT_SIZE) 各ストリームの直前コンテキスト
+            states: (2, B, STATE_SIZE) 各ストリームの再帰状態
+
+        Returns:
+            (probs, contexts, states): (B,) 発話確率と更新後の状態
+        """
+        if self.backend.thread_safe:
+            return self.backend.infer(windows, contexts, states)
+        with self._lock:
+            return self.backend.infer(windows, contexts, states)
+
+
+class EnergyGate:
+    def __init__(
+        self,
+        margin: float = VAD_GATE_MARGIN,
+        initial_floor: float = 0.003,
+        min_floor: float = 0.0005,
+        max_floor: float = 0.02,
+        alpha: float = 0.05
+    ):
+        """
+        RMS・ゼロ交差率による軽量な無音ゲートを初期化
+
+        通話ごとにノイズフロア（無音時RMSの指数移動平均）を推定し、
+        明らかにノイズフロア付近の窓はニューラル推論を省略して無音とみなす。
+
+        Args:
+            margin: ノイズフロアの何倍未満のRMSを無音とみなすか
+            initial_floor: ノイズフロアの初期値（フルスケール比）
+            min_floor: ノイズフロアの下限
+            max_floor: ノイズフロアの上限（発話を無音として学習しないため）
+            alpha: ノイズフロア更新の平滑化係数
+        """
+        self.margin = margin
+        self.floor = initial_floor
+        self.min_floor = min_floor
+        self.max_floor = max_floor
+        self.alpha = alpha
+        self.windows_total = 0
+        self.windows_skipped = 0
+
+    def should_skip(self, windows: np.ndarray) -> bool:
+        """
+        窓がすべてノイズフロア付近であれば推論を省略できると判定
+
+        低エネルギーの窓に加え、やや大きくてもゼロ交差率の高い
+        ヒスノイズ状の窓も無音とみなす。
+
+        Args:
+            windows: (N, WINDOW_SIZE) float32 音声窓
+
+        Returns:
+            bool: 推論を省略してよいかどうか
+        """
+        rms = np.sqrt(np.mean(windows * windows, axis=1))
+        signs = np.signbit(windows)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+        level = self.floor * self.margin
+        silent = (rms < level) | ((rms < level * 2) & (zcr > 0.35))
+
+        self.windows_total += len(windows)
+        if not silent.all():
+            return False
+
+        self.windows_skipped += len(windows)
+        for value in rms:
+            self._update_floor(float(value))
+        return True
+
+    def adapt(self, window: np.ndarray):
+        """モデルが無音と判定した窓でノイズフロアを更新"""
+        self._update_floor(float(np.sqrt(np.mean(window * window))))
+
+    def _update_floor(self, rms: float):
+        rms = min(max(rms, self.min_floor), self.max_floor)
+        self.floor = (1 - self.alpha) * self.floor + self.alpha * rms
+
+class VADStream:
+    def __init__(
+        self,
+        threshold: float = VAD_THRESHOLD,
+        min_speech_ms: int = VAD_MIN_SPEECH_MS,
+        min_silence_ms: int = VAD_MIN_SILENCE_MS,
+        buffer_ms: int = 1000,
+        gate: bool = VAD_GATE_ENABLED
+    ):
+        """
+        通話1本分のVADストリームを初期化
+
+        Sileroの再帰状態をストリームごとに保持し、任意長で届くPCMを
+        リングバッファで固定長の窓（8kHzで256サンプル）に切り直す。
+        窓ごとの発話確率は以下で平滑化して発話区間を判定する。
+
+        - 発話開始: threshold以上の窓がmin_speech_ms続いたとき
+        - ハングオーバー: 発話中はthreshold未満でもneg_threshold以上なら発話とみなす
+        - 発話終了: neg_threshold未満の窓がmin_silence_ms続いたとき
+
+        Args:
+            threshold: 発話とみなす確率の閾値
+            min_speech_ms: 発話開始とみなすのに必要な連続発話時間
+            min_silence_ms: 発話終了とみなすのに必要な連続無音時間
+            buffer_ms: リングバッファの容量
+            gate: 推論前のエネルギーゲートを使うかどうか
+        """
+        self.context, self.state = VoiceActivityDetector.initial_state()
+        self.threshold = threshold
+        self.neg_threshold = max(threshold - 0.15, 0.01)
+        window_ms = WINDOW_SIZE * 1000 / SAMPLE_RATE
+        self.min_speech_windows = max(1, int(np.ceil(min_speech_ms / window_ms)))
+        self.min_silence_windows = max(1, int(np.ceil(min_silence_ms / window_ms)))
+
+        capacity = max(WINDOW_SIZE * 2, SAMPLE_RATE * buffer_ms // 1000)
+        self._ring = np.zeros(capacity, dtype=np.int16)
+        self._read = 0
+        self._size = 0
+
+        self.gate = EnergyGate() if gate else None
+        # 推論待ちの窓の数（0のときだけゲートで推論を省略できる）
+        self.inflight = 0
+
+        self.is_speech = False
+        self.last_prob = 0.0
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def push(self, audio_data: bytes) -> np.ndarray:
         """
-        音声データから発話区間を検出
-        
+        PCMフレームをリングバッファに書き込み、揃った窓を取り出す
+
         Args:
             audio_data: 16-bit PCM音声データ
-            threshold: VAD検出の閾値 (0.0 - 1.0)
-            
+
+        Returns:
+            np.ndarray: (N, WINDOW_SIZE) float32 の窓（揃っていなければN=0）
+        """
+        samples = np.frombuffer(audio_data, dtype=np.int16)
+        windows: List[np.ndarray] = []
+        capacity = len(self._ring)
+        offset = 0
+        while offset < len(samples):
+            count = min(len(samples) - offset, capacity - self._size)
+            write = (self._read + self._size) % capacity
+            first = min(count, capacity - write)
+            self._ring[write:write + first] = samples[offset:offset + first]
+            self._ring[:count - first] = samples[offset + first:offset + count]
+            self._size += count
+            offset += count
+
+            while self._size >= WINDOW_SIZE:
+                end = self._read + WINDOW_SIZE
+                if end <= capacity:
+                    window = self._ring[self._read:end]
+                else:
+                    window = np.concatenate([self._ring[self._read:], self._ring[:end - capacity]])
+                windows.append(window.astype(np.float32) / 32768.0)
+                self._read = end % capacity
+                self._size -= WINDOW_SIZE
+
+        if not windows:
+            return np.zeros((0, WINDOW_SIZE), dtype=np.float32)
+        return np.stack(windows)
+
+    def observe(self, prob: float, window: Optional[np.ndarray] = None) -> bool:
+        """
+        窓1つ分の発話確率を反映して発話状態を更新
+
+        窓は到着順に渡すこと。
+
+        Args:
+            prob: 発話確率
+            window: 推論した窓（無音判定ならノイズフロアの学習に使う）
+
         Returns:
-            bool: 発話が検出されたかどうか
-        """
-        # バイトデータをnumpy配列に変換
-        audio_np = np.frombuffer(audio_data, dtype=np.int16)
-        audio_float = audio_np.astype(np.float32) / 32768.0
-        
-        # PyTorchテンソルに変換
-        audio_tensor = torch.from_numpy(audio_float)
-        
-        # VAD推論実行
-        speech_prob = self.model(audio_tensor, 8000)
-        
-        return speech_prob.item() > threshold
\ No newline at end of file
+            bool: 平滑化後の発話状態
+        """
+        self.last_prob = prob
+        if self.gate and window is not None and prob < self.neg_threshold:
+            self.gate.adapt(window)
+        if prob >= self.threshold:
+            self._speech_run += 1
+            self._silence_run = 0
+            if not self.is_speech and self._speech_run >= self.min_speech_windows:
+                self.is_speech = True
+        elif prob < self.neg_threshold:
+            self._silence_run += 1
+            self._speech_run = 0
+            if self.is_speech and self._silence_run >= self.min_silence_windows:
+                self.is_speech = False
+        elif not self.is_speech:
+            # 閾値の間の確率は発話開始の判定には数えない
+            self._speech_run = 0
+        return self.is_speech
+
+    def reset(self):
+        """モデル状態と発話判定をリセット"""
+        self.context, self.state = VoiceActivityDetector.initial_state()
+        self._read = 0
+        self._size = 0
+        self.is_speech = False
+        self.last_prob = 0.0
+        self._speech_run = 0
+        self._silence_run = 0
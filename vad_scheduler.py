@@ -0,0 +1,296 @@
+import asyncio
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from vad import VoiceActivityDetector, VADStream
+
+# 推論を実行するワーカースレッド数（同時に処理するバッチ数）
+VAD_WORKERS = int(os.getenv("VAD_WORKERS", "2"))
+# 1バッチに含める窓の上限
+VAD_MAX_BATCH = int(os.getenv("VAD_MAX_BATCH", "512"))
+# 1バッチに含める1ストリームあたりの窓の上限
+VAD_MAX_WINDOWS_PER_STREAM = int(os.getenv("VAD_MAX_WINDOWS_PER_STREAM", "8"))
+# 推論待ちにできる1ストリームあたりの窓の上限（超えた分は古い順に捨てる）
+VAD_MAX_PENDING_PER_STREAM = int(os.getenv("VAD_MAX_PENDING_PER_STREAM", "32"))
+# 推論結果を待つ上限（超えた場合は直前の判定結果を使う）
+VAD_TIMEOUT_MS = float(os.getenv("VAD_TIMEOUT_MS", "200"))
+
+# (stream_id, 窓, 結果を受け取るFuture)
+_PendingWindow = Tuple[str, np.ndarray, asyncio.Future]
+# stream_id → (推論前の文脈, 再帰状態)
+_StreamState = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+class VADBatchScheduler:
+    def __init__(
+        self,
+        detector: VoiceActivityDetector,
+        interval_ms: float = 5.0,
+        workers: int = VAD_WORKERS
+    ):
+        """
+        全通話のVAD推論をまとめて実行するスケジューラを初期化
+
+        各通話から届いた窓を数ミリ秒ごとに集めて1つのバッチテンソルにし、
+        1回の推論結果を各ストリームへ振り分ける。
+        再帰状態・窓の切り出し・平滑化はストリームごとのVADStreamが持ち、
+        推論の前後で状態を入れ替える。
+        推論はイベントループ外のスレッドプールで実行するため、
+        推論中も他の通話・HTTP API・DB処理は止まらない。
+
+        Args:
+            detector: VAD検出器
+            interval_ms: バッチを集める間隔（ミリ秒）
+            workers: 推論ワーカースレッド数
+        """
+        self.detector = detector
+        self.interval = interval_ms / 1000.0
+        self.timeout = VAD_TIMEOUT_MS / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vad")
+        self._slots = asyncio.Semaphore(workers)
+        self._streams: Dict[str, VADStream] = {}
+        self._pending: List[_PendingWindow] = []
+        self._busy: Set[str] = set()
+        self._jobs: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.windows_total = 0
+        self.windows_skipped = 0
+        self.windows_dropped = 0
+
+    async def start(self):
+        """バッチ処理ループを開始"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """バッチ処理ループを停止"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in list(self._jobs):
+            job.cancel()
+        for _, _, future in self._pending:
+            if not future.done():
+                future.cancel()
+        self._pending = []
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """VADの処理件数（エネルギーゲートで推論を省略した窓の数を含む）"""
+        return {
+            "streams": len(self._streams),
+            "pending_windows": len(self._pending),
+            "windows_total": self.windows_total,
+            "windows_skipped": self.windows_skipped,
+            "windows_dropped": self.windows_dropped,
+            "skip_ratio": self.windows_skipped / self.windows_total if self.windows_total else 0.0
+        }
+
+    def open_stream(self, stream_id: str, **kwargs) -> VADStream:
+        """
+        ストリームを登録（状態を初期化）
+
+        Args:
+            stream_id: ストリームID（通話ID）
+            **kwargs: VADStreamの平滑化パラメータ
+        """
+        stream = VADStream(**kwargs)
+        self._streams[stream_id] = stream
+        return stream
+
+    def close_stream(self, stream_id: str):
+        """ストリームの登録を解除"""
+        self._streams.pop(stream_id, None)
+
+    async def detect(self, stream_id: str, audio_data: bytes) -> bool:
+        """
+        音声フレームから発話区間を検出
+
+        フレームをストリームのリングバッファで窓に切り直して推論キューに積み、
+        推論結果を反映した平滑化後の発話状態を返す。
+        推論が混み合って一定時間内に結果が出ない場合は、
+        受信ループを止めないよう直前の発話状態を返す
+        （遅れて届いた結果も到着順にストリームへ反映される）。
+
+        Args:
+            stream_id: ストリームID（通話ID）
+            audio_data: 16-bit PCM音声データ
+
+        Returns:
+            bool: 発話中かどうか
+        """
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            stream = self.open_stream(stream_id)
+
+        windows = stream.push(audio_data)
+        if len(windows) == 0:
+            return stream.is_speech
+
+        self.windows_total += len(windows)
+
+        # 明らかな無音はニューラル推論を省略する（先行する推論待ちがない場合のみ）
+        if stream.gate and stream.inflight == 0 and stream.gate.should_skip(windows):
+            self.windows_skipped += len(windows)
+            for _ in windows:
+                stream.observe(0.0)
+            return stream.is_speech
+
+        # 推論が追いつかない場合は古い窓を捨て、待ちを上限内に抑える
+        excess = stream.inflight + len(windows) - VAD_MAX_PENDING_PER_STREAM
+        if excess > 0:
+            self._drop_oldest(stream_id, stream, excess)
+
+        stream.inflight += len(windows)
+        loop = asyncio.get_running_loop()
+        futures = []
+        for window in windows:
+            future = loop.create_future()
+            self._pending.append((stream_id, window, future))
+            futures.append(future)
+        self._wakeup.set()
+
+        await asyncio.wait(futures, timeout=self.timeout)
+        return stream.is_speech
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # 他の通話の窓が揃うまで少し待ってからまとめて推論
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+
+            # 空きワーカーができるまで待つ（その間に届いた窓は次のバッチにまとまる）
+            await self._slots.acquire()
+            batch, initial = self._take_batch()
+            if not batch:
+                self._slots.release()
+                continue
+
+            job = asyncio.create_task(self._run_batch(batch, initial))
+            self._jobs.add(job)
+            job.add_done_callback(self._jobs.discard)
+
+            # 取り残した窓があれば続けて処理する
+            if self._pending:
+                self._wakeup.set()
+
+    def _drop_oldest(self, stream_id: str, stream: VADStream, count: int):
+        """ストリームの推論待ちの窓を古い順に捨てる（推論中の窓は対象外）"""
+        rest: List[_PendingWindow] = []
+        for item in self._pending:
+            if count > 0 and item[0] == stream_id and not item[2].done():
+                item[2].cancel()
+                stream.inflight -= 1
+                self.windows_dropped += 1
+                count -= 1
+                continue
+            rest.append(item)
+        self._pending = rest
+
+    def _take_batch(self) -> Tuple[List[_PendingWindow], _StreamState]:
+        """
+        保留中の窓から次のバッチと、推論開始時点の各ストリームの状態を取り出す
+
+        推論中のストリームの窓は状態が確定するまで保留に残す。
+        1ストリームが大量の窓を送ってきても他の通話を待たせないよう、
+        ストリームごと・バッチ全体の窓数に上限を設ける。
+        状態はここで写しておくため、推論開始までに通話が閉じられても影響しない。
+        """
+        batch: List[_PendingWindow] = []
+        rest: List[_PendingWindow] = []
+        taken: Dict[str, int] = {}
+        for item in self._pending:
+            stream_id, _, future = item
+            if future.done():
+                continue
+            if stream_id not in self._streams:
+                future.set_result(0.0)
+                continue
+            count = taken.get(stream_id, 0)
+            if (
+                stream_id in self._busy
+                or count >= VAD_MAX_WINDOWS_PER_STREAM
+                or len(batch) >= VAD_MAX_BATCH
+            ):
+                rest.append(item)
+                continue
+            taken[stream_id] = count + 1
+            batch.append(item)
+        self._pending = rest
+        self._busy.update(taken)
+        initial = {
+            stream_id: (self._streams[stream_id].context, self._streams[stream_id].state)
+            for stream_id in taken
+        }
+        return batch, initial
+
+    async def _run_batch(self, batch: List[_PendingWindow], initial: _StreamState):
+        stream_ids = set(initial)
+        items = [(stream_id, window) for stream_id, window, _ in batch]
+        try:
+            loop = asyncio.get_running_loop()
+            probs, final = await loop.run_in_executor(
+                self._executor, self._infer, items, initial
+            )
+        except Exception as e:
+            print(f"VAD batch inference error: {e}")
+            probs, final = [0.0] * len(batch), {}
+        finally:
+            self._busy.difference_update(stream_ids)
+            self._slots.release()
+            if self._pending:
+                self._wakeup.set()
+
+        for stream_id, (context, state) in final.items():
+            stream = self._streams.get(stream_id)
+            if stream:
+                stream.context = context
+                stream.state = state
+
+        # ストリームごとの窓は到着順に並んでいるので、そのまま平滑化に反映する
+        for (stream_id, window, future), prob in zip(batch, probs):
+            stream = self._streams.get(stream_id)
+            if stream:
+                stream.inflight -= 1
+                stream.observe(prob, window)
+            if not future.done():
+                future.set_result(prob)
+
+    def _infer(
+        self,
+        items: List[Tuple[str, np.ndarray]],
+        initial: _StreamState
+    ) -> Tuple[List[float], _StreamState]:
+        """ワーカースレッドで実行する推論本体"""
+        # 同じストリームの窓は状態が連続するため、到着順に別ラウンドで推論する
+        rounds: List[List[int]] = []
+        depth: Dict[str, int] = {}
+        for index, (stream_id, _) in enumerate(items):
+            level = depth.get(stream_id, 0)
+            depth[stream_id] = level + 1
+            if level == len(rounds):
+                rounds.append([])
+            rounds[level].append(index)
+
+        current = dict(initial)
+        probs = [0.0] * len(items)
+        for indices in rounds:
+            stream_ids = [items[i][0] for i in indices]
+            windows = np.stack([items[i][1] for i in indices])
+            contexts = np.stack([current[stream_id][0] for stream_id in stream_ids])
+            states = np.stack([current[stream_id][1] for stream_id in stream_ids], axis=1)
+
+            round_probs, contexts, states = self.detector.infer_batch(windows, contexts, states)
+
+            for j, (index, stream_id) in enumerate(zip(indices, stream_ids)):
+                prob = float(round_probs[j])
+                probs[index] = prob
+                current[stream_id] = (contexts[j], states[:, j])
+
+        return probs, current
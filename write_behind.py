@@ -0,0 +1,139 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+from database import Database
+
+# まとめて書き込む件数と、書き込みを待たせる最大時間
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+# キューの上限（満杯の場合は書き込み側を待たせる）
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+# 書き込み失敗時の再試行回数
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+# シャットダウン時に残りを書き込む最大時間（秒）
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.getenv("WRITE_BEHIND_DRAIN_TIMEOUT", "10"))
+
+# ("message" | "dtmf", 行)
+_Item = Tuple[str, tuple]
+
+class WriteBehindWriter:
+    def __init__(
+        self,
+        database: Database,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_ms: float = WRITE_BEHIND_FLUSH_MS,
+        max_queue: int = WRITE_BEHIND_MAX_QUEUE
+    ):
+        """
+        会話メッセージ・DTMF入力の非同期一括書き込みを初期化
+
+        呼び出し側はキューに積むだけで戻り、件数または時間の閾値で
+        executemanyによりまとめてINSERTする。作成日時は積んだ時点で
+        確定させるため、書き込みが遅れても記録上の順序は変わらない。
+
+        Args:
+            database: 書き込み先データベース
+            batch_size: 1回に書き込む最大件数
+            flush_ms: 最初の1件を積んでから書き込むまでの最大待ち時間
+            max_queue: キューの上限
+        """
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    async def start(self):
+        """書き込みループを開始"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """キューに残った分を書き込んでから停止"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), WRITE_BEHIND_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Warning: write-behind queue was not drained ({self._queue.qsize()} items left)")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def save_message(self, call_id: str, content: str, type: str):
+        """メッセージの保存をキューに積む（キューが満杯の場合は空くまで待つ）"""
+        await self._queue.put(("message", (call_id, content, type, datetime.utcnow())))
+
+    async def save_dtmf(self, call_id: str, digit: str, timestamp: Optional[datetime] = None):
+        """DTMF入力の保存をキューに積む（キューが満杯の場合は空くまで待つ）"""
+        await self._queue.put(("dtmf", (call_id, digit, timestamp or datetime.utcnow())))
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[_Item] = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[_Item]):
+        messages = [row for kind, row in batch if kind == "message"]
+        dtmf_events = [row for kind, row in batch if kind == "dtmf"]
+
+        for rows, write in (
+            (messages, self.database.save_messages),
+            (dtmf_events, self.database.save_dtmf_events)
+        ):
+            if not rows:
+                continue
+            for attempt in range(WRITE_BEHIND_RETRIES + 1):
+                try:
+                    await write(rows)
+                    self.written += len(rows)
+                    break
+                except Exception as e:
+                    if attempt == WRITE_BEHIND_RETRIES:
+                        print(f"Failed to write {len(rows)} rows after retries: {e}")
+                        await self._write_each(rows, write)
+                    else:
+                        await asyncio.sleep(0.5 * (attempt + 1))
+
+    async def _write_each(self, rows: List[tuple], write):
+        """1件ずつ書き込み、失敗した行だけを破棄する（不正な1行でまとめて失わないため）"""
+        for row in rows:
+            try:
+                await write([row])
+                self.written += 1
+            except Exception as e:
+                print(f"Dropped write-behind row {row!r}: {e}")
+                self.dropped += 1